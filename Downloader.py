@@ -1,12 +1,80 @@
-import yt_dlp
+import argparse
 import shutil
+import subprocess
 import sys
 import os
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from progress import ProgressMultiplexer
+from metrics import PipelineMetrics, YtdlpLogger
+from catalog import CATALOG_FILENAME, DownloadCatalog
+from verify import Verifier
+import mediastrip
 
 # Константы
 MAX_WORKERS_PER_SITE = 4  # Максимальное количество потоков для одного сайта (0 = полное распараллеливание)
 DEFAULT_DOWNLOAD_PATH = "F:/G/Download"  # Путь по умолчанию
+METRICS_JSONL_FILENAME = "downloader_metrics.jsonl"  # Метрики (JSON Lines) в папке загрузок
+METRICS_PROMETHEUS_FILENAME = "downloader.prom"  # Метрики (Prometheus) в папке загрузок
+VERIFY_DOWNLOADS = True  # Проверять готовые файлы ffprobe и записывать хэш в каталог
+STRIP_MEDIA_METADATA = False  # Удалять из готовых файлов название, комментарии, кодировщик и ссылку на источник
+LIST_LIMIT = 50  # Сколько файлов показывать в списке перед конвертацией
+
+# Служебные файлы в папке загрузок, которые не считаются скачанными
+SERVICE_FILES = {
+    METRICS_JSONL_FILENAME,
+    METRICS_PROMETHEUS_FILENAME,
+    CATALOG_FILENAME,
+    CATALOG_FILENAME + "-wal",
+    CATALOG_FILENAME + "-shm",
+}
+
+metrics = PipelineMetrics()  # Метрики текущего запуска
+profiler = None  # PhaseProfiler в режиме --profile
+_yt_dlp = None  # Модуль yt_dlp, импортируется при первом обращении
+
+def catalog_path():
+    """
+    Путь каталога скачанных файлов в текущей папке загрузок.
+    Строится при каждом вызове: DEFAULT_DOWNLOAD_PATH можно сменить во время работы (например, в бенчмарке).
+    """
+    return os.path.join(DEFAULT_DOWNLOAD_PATH, CATALOG_FILENAME)
+
+def export_metrics():
+    """Выгружает накопленные метрики в папку загрузок (JSON Lines и Prometheus)."""
+    metrics.export(os.path.join(DEFAULT_DOWNLOAD_PATH, METRICS_JSONL_FILENAME),
+                   os.path.join(DEFAULT_DOWNLOAD_PATH, METRICS_PROMETHEUS_FILENAME))
+
+def load_yt_dlp():
+    """
+    Импортирует yt_dlp при первой необходимости.
+    Импорт загружает сотни экстракторов, поэтому меню и конвертация запускаются без него.
+    """
+    global _yt_dlp
+    if _yt_dlp is None:
+        import yt_dlp
+        _yt_dlp = yt_dlp
+    return _yt_dlp
+
+@contextmanager
+def phase(url, name):
+    """Отмечает фазу конвейера для метрик и, в режиме --profile, для профилировщика."""
+    with metrics.phase(url, name):
+        if profiler is None:
+            yield
+        else:
+            with profiler.phase(name):
+                yield
+
+def log(message, progress=None):
+    """Выводит сообщение через мультиплексор прогресса, если он активен."""
+    if progress is not None:
+        progress.log(message)
+    else:
+        print(message)
 
 def check_ffmpeg():
     if not shutil.which("ffmpeg"):
@@ -22,16 +90,17 @@ def clean_youtube_playlist_url(url):
         return base_url
     return url
 
-def analyze_url(url):
+def analyze_url(url, progress=None):
+    yt_dlp = load_yt_dlp()
     try:
-        with yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
+        with phase(url, "probe"), yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
             info = ydl.extract_info(url, download=False)
             if 'entries' in info:
                 return "playlist"
             elif 'title' in info:
                 return "single_video"
     except yt_dlp.utils.DownloadError as e:
-        print(f"URL не поддерживается: {url}. Пропускаем...")
+        log(f"URL не поддерживается: {url}. Пропускаем...", progress)
         return None
     except Exception:
         pass
@@ -51,8 +120,10 @@ def get_playlist_range(total_videos):
         except ValueError:
             print("Пожалуйста, введите корректный диапазон (например, 1-3 или 0).")
 
-def download_content(url, content_type, is_playlist=False, playlist_range=None):
-    print(f"Начинаем загрузку {'аудио' if content_type == 'audio' else 'видео'}: {url}")
+def download_content(url, content_type, is_playlist=False, playlist_range=None, progress=None,
+                     verifier=None, attempt=1, catalog=None):
+    yt_dlp = load_yt_dlp()
+    log(f"Начинаем загрузку {'аудио' if content_type == 'audio' else 'видео'}: {url}", progress)
 
     if content_type == "audio":
         ydl_opts = {
@@ -75,46 +146,111 @@ def download_content(url, content_type, is_playlist=False, playlist_range=None):
             'playlistend': playlist_range[1],
         })
 
+    ydl_opts.update({
+        'progress_hooks': [metrics.progress_hook(url)],
+        'postprocessor_hooks': [metrics.postprocessor_hook(url)],
+    })
+    if STRIP_MEDIA_METADATA:
+        # До каталога и проверки, чтобы хэш считался по уже очищенному файлу
+        ydl_opts['postprocessor_hooks'].append(
+            mediastrip.postprocessor_hook(lambda message: log(message, progress)))
+    if catalog is not None:
+        ydl_opts['postprocessor_hooks'].append(catalog.postprocessor_hook(url))
+    if verifier is not None:
+        ydl_opts['postprocessor_hooks'].append(verifier.postprocessor_hook(url, is_playlist, attempt, catalog))
+    if progress is not None:
+        # Собственный вывод yt-dlp заменяется общей таблицей прогресса
+        ydl_opts['progress_hooks'].append(progress.hook(url))
+        ydl_opts.update({
+            'quiet': True,
+            'noprogress': True,
+            'logger': YtdlpLogger(metrics, url, progress.log),
+        })
+
     try:
         os.makedirs(DEFAULT_DOWNLOAD_PATH, exist_ok=True)  # Создаем папку для загрузок
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with phase(url, "download"), yt_dlp.YoutubeDL(ydl_opts) as ydl:
             ydl.download([url])
-        print(f"Загрузка завершена: {url}")
+        log(f"Загрузка завершена: {url}", progress)
+        return True
     except yt_dlp.utils.DownloadError as e:
-        print(f"Ошибка при скачивании: {e}")
+        log(f"Ошибка при скачивании: {e}", progress)
     except Exception as e:
-        print(f"Произошла непредвиденная ошибка: {e}")
+        log(f"Произошла непредвиденная ошибка: {e}", progress)
+    metrics.add_error(url)
+    return False
 
-def process_link(url, content_type, playlist_ranges):
-    print("-" * 50)  # Разделитель
-    content_type_detected = analyze_url(url)
+def process_link(url, content_type, playlist_ranges, progress=None, queued_at=None, verifier=None,
+                 catalog=None):
+    if queued_at is not None:
+        metrics.add_queue_wait(url, time.monotonic() - queued_at)
+    if progress is None:
+        print("-" * 50)  # Разделитель
+    else:
+        progress.begin(url, url)
+    ok = False
+    content_type_detected = analyze_url(url, progress)
     if content_type_detected == "playlist":
-        print(f"Ссылка '{url}' распознана как плейлист.")
+        log(f"Ссылка '{url}' распознана как плейлист.", progress)
         playlist_range = playlist_ranges.get(url)  # Получаем диапазон из словаря
         if playlist_range is None:
-            print(f"Диапазон для плейлиста '{url}' не найден. Скачиваем все видео.")
+            log(f"Диапазон для плейлиста '{url}' не найден. Скачиваем все видео.", progress)
             playlist_range = (1, float('inf'))  # По умолчанию скачивать все видео
-        download_content(url, content_type, is_playlist=True, playlist_range=playlist_range)
+        ok = download_content(url, content_type, is_playlist=True, playlist_range=playlist_range,
+                              progress=progress, verifier=verifier, catalog=catalog)
     elif content_type_detected == "single_video":
-        print(f"Ссылка '{url}' распознана как одиночное видео.")
-        download_content(url, content_type, is_playlist=False)
+        log(f"Ссылка '{url}' распознана как одиночное видео.", progress)
+        ok = download_content(url, content_type, is_playlist=False, progress=progress, verifier=verifier,
+                              catalog=catalog)
     else:
-        print(f"Не удалось определить тип контента для ссылки: {url}")
-    print("-" * 50)  # Разделитель
+        log(f"Не удалось определить тип контента для ссылки: {url}", progress)
+        metrics.add_error(url)
+    if progress is None:
+        print("-" * 50)  # Разделитель
+    else:
+        progress.end(url, ok)
+    return ok
+
+def link_domain(link):
+    """Домен ссылки; yt-dlp принимает и ссылки без схемы (youtu.be/xyz), для них тоже."""
+    return urlsplit(link if "://" in link else "//" + link).netloc or link
 
-def process_links_parallel(links, content_type, max_workers_per_site, playlist_ranges):
+def process_links_parallel(links, content_type, max_workers_per_site, playlist_ranges, catalog_file=None):
     sites = {}
     for link in links:
-        domain = link.split('/')[2]  # Извлекаем домен (например, youtube.com)
+        domain = link_domain(link)  # Извлекаем домен (например, youtube.com)
         if domain not in sites:
             sites[domain] = []
         sites[domain].append(link)
 
-    with ThreadPoolExecutor(max_workers=max_workers_per_site) as executor:
+    catalog = DownloadCatalog(catalog_file or catalog_path())
+    with ProgressMultiplexer() as progress, ThreadPoolExecutor(max_workers=max_workers_per_site) as executor:
+        verifier = None
+        if VERIFY_DOWNLOADS:
+            def requeue(job):
+                return executor.submit(retry_download, job, content_type, progress, verifier,
+                                       job['catalog'] or catalog)
+            verifier = Verifier(catalog, requeue, progress.log)
+
+        futures = []
         for domain, domain_links in sites.items():
-            print(f"Обрабатываем {len(domain_links)} ссылок для сайта: {domain}")
+            progress.log(f"Обрабатываем {len(domain_links)} ссылок для сайта: {domain}")
             for link in domain_links:
-                executor.submit(process_link, link, content_type, playlist_ranges)
+                futures.append(executor.submit(process_link, link, content_type, playlist_ranges, progress,
+                                               time.monotonic(), verifier, catalog))
+        wait(futures)
+        if verifier is not None:
+            # Проверки идут параллельно с загрузками; ждём их и повторные загрузки
+            verifier.close()
+    catalog.close()
+
+def retry_download(job, content_type, progress, verifier, catalog):
+    """Повторно скачивает файл, не прошедший проверку целостности (в той же строке прогресса, что и ссылка)."""
+    progress.resume(job['url'], job['url'])
+    ok = download_content(job['url'], content_type, job['is_playlist'], job['playlist_range'],
+                          progress, verifier, job['attempt'], catalog)
+    progress.end(job['url'], ok)
+    return ok
 
 def analyze_downloaded_files():
     download_folder = DEFAULT_DOWNLOAD_PATH
@@ -122,22 +258,37 @@ def analyze_downloaded_files():
         print(f"Папка {download_folder} не найдена. Нет файлов для анализа.")
         return
 
-    files = []
-    for root, _, filenames in os.walk(download_folder):
-        for filename in filenames:
-            files.append(os.path.join(root, filename))
+    catalog = DownloadCatalog(catalog_path())
+    try:
+        with phase(download_folder, "scan"):
+            # Перечитываются только папки с изменившимся mtime
+            catalog.sync(download_folder, SERVICE_FILES)
+        choose_and_convert(catalog, download_folder)
+    finally:
+        catalog.close()
 
-    if not files:
+def choose_and_convert(catalog, download_folder):
+    counts = catalog.format_counts(download_folder)
+    if not counts:
         print(f"В папке {download_folder} нет файлов для анализа.")
         return
 
     print("Обнаруженные файлы:")
-    for file in files:
-        ext = os.path.splitext(file)[1][1:].lower()  # Получаем расширение файла
-        print(f"- {file} ({ext})")
+    for ext, count, size in counts:
+        print(f"- {ext or 'без расширения'}: {count} файлов, {size / 1024 / 1024:.1f} МБ")
+    for row in catalog.query(download_folder, limit=LIST_LIMIT):
+        print(f"- {row['path']} ({row['ext']})")
+    total = sum(count for _, count, _ in counts)
+    if total > LIST_LIMIT:
+        print(f"... и ещё {total - LIST_LIMIT} файлов")
 
     convert = input("Хотите выполнить конвертацию? (да/нет): ").lower()
     if convert == "да":
+        source_ext = input("Какие файлы конвертировать? Введите расширение (Enter = все): ").strip().lower()
+        files = [row['path'] for row in catalog.query(download_folder, ext=source_ext or None)]
+        if not files:
+            print("Нет файлов с таким расширением. Конвертация отменена.")
+            return
         supported_formats = ["mp3", "mp4", "m4a", "wav", "flac", "avi", "mkv"]
         print("Доступные форматы для конвертации:")
         for i, fmt in enumerate(supported_formats, 1):
@@ -154,14 +305,21 @@ def analyze_downloaded_files():
             return
 
         for file in files:
-            convert_file(file, target_format)
+            if not os.path.exists(file):
+                print(f"Файл {file} не найден, пропускаем.")
+                catalog.remove(file)
+                continue
+            output_file = convert_file(file, target_format)
+            if not output_file or not os.path.exists(output_file):
+                continue  # Конвертация не удалась: оригинал оставляем
             os.remove(file)  # Удаляем оригинальный файл после конвертации
+            catalog.remove(file)
+            catalog.record_file(output_file)
     else:
         print("Конвертация отменена.")
 
 def convert_file(file, output_format):
     try:
-        import subprocess
         output_file = os.path.splitext(file)[0] + f".{output_format}"
         ffmpeg_command = [
             'ffmpeg',
@@ -171,10 +329,14 @@ def convert_file(file, output_format):
             output_file
         ]
         print(f"Выполняем конвертацию файла: {file}")
-        subprocess.run(ffmpeg_command, check=True)
+        with phase(file, "convert"):
+            subprocess.run(ffmpeg_command, check=True)
+        metrics.add(file, "convert", size=os.path.getsize(output_file), count=0)
         print(f"Конвертация завершена: {output_file}")
+        return output_file
     except Exception as e:
         print(f"Ошибка при конвертации файла {file}: {e}")
+        metrics.add_error(file)
 
 def process_links_from_file(file_path, content_type):
     while True:
@@ -198,7 +360,7 @@ def process_links_from_file(file_path, content_type):
     for link in links:
         if analyze_url(link) == "playlist":
             print(f"В файле обнаружен плейлист: {link}")
-            with yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
+            with load_yt_dlp().YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
                 info = ydl.extract_info(link, download=False)
                 total_videos = len(info['entries'])
                 print(f"Обнаружен плейлист с {total_videos} видео.")
@@ -206,8 +368,153 @@ def process_links_from_file(file_path, content_type):
 
     process_links_parallel(links, content_type, MAX_WORKERS_PER_SITE, playlist_ranges)
     analyze_downloaded_files()
+    export_metrics()
 
-if __name__ == "__main__":
+def run_coordinator(queue_path, file_path, content_type):
+    """
+    Координатор распределённой загрузки: ставит ссылки из файла в очередь,
+    следит за воркерами и по завершении сливает их результаты в каталог.
+    Плейлисты ставятся в очередь целиком.
+    """
+    from distributed import JobQueue, POLL_INTERVAL, WORKER_TIMEOUT
+
+    with open(file_path, 'r', encoding='utf-8') as file:
+        links = [clean_youtube_playlist_url(line.strip()) for line in file if line.strip()]
+    queue = JobQueue(queue_path)
+    try:
+        added = queue.seed(links, content_type)
+        print(f"В очередь {queue_path} добавлено заданий: {added} (ссылок в файле: {len(links)})")
+        print("Запустите воркеры: python Downloader.py --worker " + queue_path)
+        while True:
+            reclaimed = queue.reclaim_expired()
+            if reclaimed:
+                print(f"Возвращено в очередь заданий от пропавших воркеров: {reclaimed}")
+            now = time.time()
+            alive = [w for w in queue.workers()
+                     if w['status'] == 'active' and now - w['heartbeat'] < WORKER_TIMEOUT]
+            counts = queue.counts()
+            print(f"Очередь: ожидают {counts.get('pending', 0)} | в работе {counts.get('leased', 0)} | "
+                  f"готово {counts.get('done', 0)} | ошибки {counts.get('failed', 0)} | "
+                  f"воркеров: {len(alive)}")
+            if queue.is_drained() and not alive:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        catalog = DownloadCatalog(catalog_path())
+        try:
+            results = queue.results()
+            for row in results:
+                catalog.record_download(row['path'], row['url'], {
+                    'id': row['video_id'], 'title': row['title'],
+                    'duration': row['duration'], 'filesize': row['size'],
+                }, worker=row['worker'])
+                if row['status']:
+                    catalog.record_verification(row['path'], row['url'], row['size'], row['sha256'],
+                                                row['duration'], row['status'], worker=row['worker'])
+        finally:
+            catalog.close()
+        print(f"Результаты воркеров ({len(results)} файлов) добавлены в каталог {catalog_path()}")
+    finally:
+        queue.close()
+
+def run_worker(queue_path, name=None, max_workers=MAX_WORKERS_PER_SITE):
+    """
+    Воркер распределённой загрузки: берёт задания из очереди в аренду,
+    продлевает её heartbeat-ом и завершает работу, когда очередь опустела.
+    """
+    from distributed import JobQueue, ResultSink, HEARTBEAT_INTERVAL, POLL_INTERVAL, default_worker_name
+
+    name = name or default_worker_name()
+    max_workers = max_workers or os.cpu_count()
+    queue = JobQueue(queue_path)
+    queue.register(name)
+    stop = threading.Event()
+
+    def heartbeat_loop():
+        heartbeat_queue = JobQueue(queue_path)  # Своё соединение для фонового потока
+        try:
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                heartbeat_queue.heartbeat(name)
+        finally:
+            heartbeat_queue.close()
+
+    heartbeat = threading.Thread(target=heartbeat_loop, name="heartbeat", daemon=True)
+    heartbeat.start()
+    print(f"Воркер {name} подключён к очереди {queue_path}")
+    content_types = {}  # url -> тип контента, для повторных загрузок после проверки
+    try:
+        with ProgressMultiplexer() as progress, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            verifier = None
+            if VERIFY_DOWNLOADS:
+                def requeue(job):
+                    return executor.submit(retry_download, job, content_types[job['url']], progress,
+                                           verifier, job['catalog'])
+                verifier = Verifier(None, requeue, progress.log)
+
+            in_flight = {}
+            while True:
+                while len(in_flight) < max_workers:
+                    job = queue.lease(name)
+                    if job is None:
+                        break
+                    content_types[job['url']] = job['content_type']
+                    playlist_ranges = {}
+                    if job['playlist_start']:
+                        playlist_ranges[job['url']] = (job['playlist_start'], job['playlist_end'] or float('inf'))
+                    sink = ResultSink(queue_path, job['id'], name)
+                    future = executor.submit(process_link, job['url'], job['content_type'], playlist_ranges,
+                                             progress, time.monotonic(), verifier, sink)
+                    in_flight[future] = job
+                if not in_flight:
+                    if queue.is_drained():
+                        break
+                    time.sleep(POLL_INTERVAL)  # Задания у других воркеров: ждём возврата в очередь
+                    continue
+                done, _ = wait(in_flight, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    ok = future.exception() is None and future.result()
+                    queue.complete(job['id'], name, ok, None if ok else "ошибка загрузки")
+            if verifier is not None:
+                verifier.close()
+    finally:
+        stop.set()
+        heartbeat.join()
+        queue.unregister(name)
+        queue.close()
+        export_metrics()  # В том числе при прерывании: метрики выполненных заданий не теряются
+    print(f"Воркер {name}: очередь пуста, работа завершена.")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Скачивание аудио и видео через yt-dlp")
+    parser.add_argument("--profile", nargs="?", const="profile", metavar="DIR",
+                        help="Профилировать фазы конвейера и сохранить отчёты в папку DIR (по умолчанию: profile)")
+    parser.add_argument("--convert", action="store_true",
+                        help="Только показать скачанные файлы и предложить конвертацию (без загрузки)")
+    parser.add_argument("--check", metavar="URL",
+                        help="Только определить тип ссылки (плейлист или одиночное видео)")
+    parser.add_argument("--coordinator", metavar="QUEUE_DB",
+                        help="Распределённый режим: поставить ссылки в очередь QUEUE_DB и следить за воркерами")
+    parser.add_argument("--worker", metavar="QUEUE_DB",
+                        help="Распределённый режим: выполнять задания из очереди QUEUE_DB")
+    parser.add_argument("--links", default="main.txt", help="Файл со ссылками для координатора")
+    parser.add_argument("--type", choices=("audio", "video"), default="video",
+                        help="Тип контента для координатора")
+    parser.add_argument("--name", help="Имя воркера (по умолчанию: хост-PID)")
+    parser.add_argument("--threads", type=int, default=MAX_WORKERS_PER_SITE, help="Потоков загрузки воркера")
+    return parser.parse_args()
+
+def check_link(url):
+    """Выводит тип контента для одной ссылки."""
+    content_type_detected = analyze_url(clean_youtube_playlist_url(url))
+    if content_type_detected == "playlist":
+        print(f"Ссылка '{url}' распознана как плейлист.")
+    elif content_type_detected == "single_video":
+        print(f"Ссылка '{url}' распознана как одиночное видео.")
+    else:
+        print(f"Не удалось определить тип контента для ссылки: {url}")
+
+def main():
     print("Что вы хотите скачать?")
     print("1. Аудио")
     print("2. Видео")
@@ -227,18 +534,40 @@ if __name__ == "__main__":
     source_choice = input("Введите номер (1 или 2): ")
 
     if source_choice == "1":
-        url = input("Введите URL видео или плейлиста: ").strip()
+        url = clean_youtube_playlist_url(input("Введите URL видео или плейлиста: ").strip())
         playlist_ranges = {}
         if analyze_url(url) == "playlist":
-            with yt_dlp.YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
+            with load_yt_dlp().YoutubeDL({'extract_flat': True, 'quiet': True}) as ydl:
                 info = ydl.extract_info(url, download=False)
                 total_videos = len(info['entries'])
                 print(f"Обнаружен плейлист с {total_videos} видео.")
                 playlist_ranges[url] = get_playlist_range(total_videos)
-        process_link(clean_youtube_playlist_url(url), content_type, playlist_ranges)
+        process_links_parallel([url], content_type, MAX_WORKERS_PER_SITE, playlist_ranges)
         analyze_downloaded_files()
+        export_metrics()
     elif source_choice == "2":
         file_path = "main.txt"
         process_links_from_file(file_path, content_type)
     else:
-        print("Неверный выбор. Пожалуйста, введите 1 или 2.")
\ No newline at end of file
+        print("Неверный выбор. Пожалуйста, введите 1 или 2.")
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.profile:
+        from profiling import PhaseProfiler
+        profiler = PhaseProfiler(args.profile).start()
+    try:
+        if args.coordinator:
+            run_coordinator(args.coordinator, args.links, args.type)
+        elif args.worker:
+            run_worker(args.worker, args.name, args.threads)
+        elif args.check:
+            check_link(args.check)
+        elif args.convert:
+            analyze_downloaded_files()
+            export_metrics()
+        else:
+            main()
+    finally:
+        if profiler is not None:
+            profiler.stop()
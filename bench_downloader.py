@@ -0,0 +1,278 @@
+"""
+Офлайн-бенчмарк конвейера загрузки.
+
+Поднимает локальный HTTP-сервер с синтетическими медиафайлами и RSS-плейлистами
+(их обрабатывает generic-экстрактор yt-dlp), эмулирует задержку, ограничение
+скорости на соединение и общий лимит канала, после чего прогоняет
+process_links_parallel при разных количествах потоков и размерах файлов.
+Сеть не нужна: все запросы идут на 127.0.0.1.
+
+Пример:
+    python bench_downloader.py --workers 1,2,4,8 --sizes 1,8 --items 8 --latency 0.05
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import Downloader
+from metrics import PipelineMetrics
+
+# Константы
+BLOCK_SIZE = 64 * 1024  # Размер блока синтетических данных
+MB = 1024 * 1024
+
+
+class TokenBucket:
+    """Общий лимит пропускной способности для всех соединений сервера."""
+
+    def __init__(self, rate):
+        self.rate = rate  # байт/сек, 0 = без ограничения
+        self.lock = threading.Lock()
+        self.available = 0.0
+        self.updated = time.monotonic()
+
+    def consume(self, amount):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.rate, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+
+class MediaServer:
+    """
+    Локальный сервер синтетического контента:
+    /media/<размер_байт>/<имя>.mp4 — медиафайл указанного размера,
+    /playlist/<размер_байт>/<количество>.xml — RSS-лента с медиафайлами.
+    """
+
+    def __init__(self, latency=0.0, bandwidth=0, throttle=0):
+        self.latency = latency  # Задержка перед ответом (сек)
+        self.bandwidth = bandwidth  # Лимит на соединение (байт/сек, 0 = без лимита)
+        self.bucket = TokenBucket(throttle)  # Общий лимит сервера
+        self.block = random.Random(0).randbytes(BLOCK_SIZE)
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def media_url(self, size, name):
+        return f"{self.base_url}/media/{size}/{name}.mp4"
+
+    def playlist_url(self, size, count):
+        return f"{self.base_url}/playlist/{size}/{count}.xml"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _route(self):
+                parts = self.path.split('?')[0].strip('/').split('/')
+                if len(parts) == 3 and parts[0] in ("media", "playlist") and parts[1].isdigit():
+                    return parts[0], int(parts[1]), parts[2]
+                return None, 0, None
+
+            def _playlist_body(self, size, name):
+                count = int(name.split('.')[0]) if name.split('.')[0].isdigit() else 1
+                items = "".join(
+                    f"<item><title>item{i:04d}</title><guid>item{i:04d}</guid>"
+                    f"<enclosure url=\"{server.media_url(size, f'item{i:04d}')}\" "
+                    f"length=\"{size}\" type=\"video/mp4\"/></item>"
+                    for i in range(1, count + 1)
+                )
+                return (f"<?xml version=\"1.0\"?><rss version=\"2.0\"><channel>"
+                        f"<title>bench{count}</title><link>{server.base_url}</link>"
+                        f"{items}</channel></rss>").encode()
+
+            def _respond(self, send_body):
+                with server.lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                kind, size, name = self._route()
+                if kind is None:
+                    self.send_error(404)
+                    return
+                if kind == "playlist":
+                    body = self._playlist_body(size, name)
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/rss+xml")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    if send_body:
+                        self.wfile.write(body)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                if not send_body:
+                    return
+                remaining = size
+                started = time.monotonic()
+                sent = 0
+                while remaining > 0:
+                    chunk = server.block[:min(BLOCK_SIZE, remaining)]
+                    server.bucket.consume(len(chunk))
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    sent += len(chunk)
+                    if server.bandwidth:
+                        ahead = sent / server.bandwidth - (time.monotonic() - started)
+                        if ahead > 0:
+                            time.sleep(ahead)
+                with server.lock:
+                    server.bytes_sent += size
+
+            def do_GET(self):
+                try:
+                    self._respond(True)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def do_HEAD(self):
+                self._respond(False)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def percentile(values, fraction):
+    """Перцентиль по методу ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run_once(server, workers, size, items, playlist=False, content_type="video"):
+    """Прогоняет конвейер один раз и возвращает словарь с результатами."""
+    download_dir = tempfile.mkdtemp(prefix="bench_dl_")
+    saved_path, saved_metrics = Downloader.DEFAULT_DOWNLOAD_PATH, Downloader.metrics
+    Downloader.DEFAULT_DOWNLOAD_PATH = download_dir
+    Downloader.metrics = PipelineMetrics()
+    try:
+        if playlist:
+            links = [server.playlist_url(size, items)]
+        else:
+            tag = f"w{workers}s{size}"
+            links = [server.media_url(size, f"{tag}_{i:04d}") for i in range(items)]
+
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Каталог — во временной папке прогона, а не в настоящей папке загрузок
+            Downloader.process_links_parallel(links, content_type, workers, {},
+                                              os.path.join(download_dir, Downloader.CATALOG_FILENAME))
+        elapsed = time.perf_counter() - started
+
+        latencies = []
+        total_bytes = 0
+        errors = 0
+        for link in Downloader.metrics.links.values():
+            latencies.append(link["queue_wait"] + sum(max(p["wall"], 0) for p in link["phases"].values()))
+            total_bytes += link["phases"].get("download", {}).get("bytes", 0)
+            errors += link["errors"]
+        downloaded = sum(1 for _, _, files in os.walk(download_dir)
+                         for name in files if name not in Downloader.SERVICE_FILES)
+        return {
+            "mode": "playlist" if playlist else "links",
+            "workers": workers,
+            "size_mb": size / MB,
+            "items": downloaded,
+            "errors": errors,
+            "seconds": elapsed,
+            "items_per_sec": downloaded / elapsed if elapsed > 0 else 0.0,
+            "mb_per_sec": total_bytes / MB / elapsed if elapsed > 0 else 0.0,
+            "p50_s": percentile(latencies, 0.50),
+            "p95_s": percentile(latencies, 0.95),
+        }
+    finally:
+        Downloader.DEFAULT_DOWNLOAD_PATH, Downloader.metrics = saved_path, saved_metrics
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def parse_list(text, cast):
+    return [cast(item) for item in text.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк Downloader.py на локальном сервере")
+    parser.add_argument("--workers", default="1,2,4,8", help="Количества потоков через запятую")
+    parser.add_argument("--sizes", default="1,8", help="Размеры файлов в МБ через запятую")
+    parser.add_argument("--items", type=int, default=8, help="Файлов на прогон")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа сервера (сек)")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Лимит на соединение (МБ/с, 0 = без лимита)")
+    parser.add_argument("--throttle", type=float, default=0, help="Общий лимит сервера (МБ/с, 0 = без лимита)")
+    parser.add_argument("--playlist", action="store_true", help="Скачивать файлы одним RSS-плейлистом")
+    parser.add_argument("--json", help="Дописать результаты в файл JSON Lines")
+    args = parser.parse_args()
+
+    results = []
+    with MediaServer(args.latency, int(args.bandwidth * MB), int(args.throttle * MB)) as server:
+        print(f"Сервер: {server.base_url} | задержка {args.latency} с | "
+              f"лимит соединения {args.bandwidth or '∞'} МБ/с | общий лимит {args.throttle or '∞'} МБ/с")
+        print(f"{'режим':<9}{'потоки':>7}{'МБ':>7}{'файлы':>7}{'ошибки':>7}{'сек':>9}"
+              f"{'ф/с':>9}{'МБ/с':>9}{'p50, с':>9}{'p95, с':>9}")
+        for size_mb in parse_list(args.sizes, float):
+            for workers in parse_list(args.workers, int):
+                result = run_once(server, workers, int(size_mb * MB), args.items, args.playlist)
+                results.append(result)
+                print(f"{result['mode']:<9}{workers:>7}{size_mb:>7g}{result['items']:>7}{result['errors']:>7}"
+                      f"{result['seconds']:>9.2f}{result['items_per_sec']:>9.2f}{result['mb_per_sec']:>9.1f}"
+                      f"{result['p50_s']:>9.3f}{result['p95_s']:>9.3f}")
+        print(f"Запросов к серверу: {server.requests}, отдано {server.bytes_sent / MB:.1f} МБ")
+
+    if args.json:
+        with open(args.json, 'a', encoding='utf-8') as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+    if results:
+        print(f"Медиана ф/с по всем прогонам: {statistics.median(r['items_per_sec'] for r in results):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Замер времени запуска Downloader.py.
+
+Каждый сценарий запускается в отдельном процессе несколько раз, выводятся
+минимальное и медианное время, а также был ли импортирован yt_dlp.
+Сценарии не обращаются к сети.
+
+Пример:
+    python bench_startup.py --repeat 10
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Константы
+TARGET_MS = 200  # Целевое время запуска для небольших вызовов
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = (
+    ("интерпретатор", ["-c", "pass"]),
+    ("import Downloader", ["-c", "import Downloader, sys; "
+                                 "sys.exit(3 if 'yt_dlp' in sys.modules else 0)"]),
+    ("Downloader.py --help", ["Downloader.py", "--help"]),
+    ("import yt_dlp", ["-c", "import yt_dlp"]),
+    ("yt_dlp + YoutubeDL()", ["-c", "import yt_dlp; yt_dlp.YoutubeDL({'quiet': True})"]),
+)
+
+
+def lazy_extractors_available():
+    """Проверяет наличие сборки lazy_extractors без импорта yt_dlp."""
+    spec = importlib.util.find_spec("yt_dlp")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    package_dir = list(spec.submodule_search_locations)[0]
+    return os.path.exists(os.path.join(package_dir, "extractor", "lazy_extractors.py"))
+
+
+def measure(arguments, repeat):
+    """Возвращает (список времён в мс, код возврата последнего запуска)."""
+    timings = []
+    returncode = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, *arguments], cwd=HERE,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+        returncode = completed.returncode
+    return timings, returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер времени запуска Downloader.py")
+    parser.add_argument("--repeat", type=int, default=5, help="Запусков на сценарий")
+    args = parser.parse_args()
+
+    lazy = lazy_extractors_available()
+    if lazy is None:
+        print("yt_dlp не установлен: сценарии с yt_dlp завершатся ошибкой.")
+    else:
+        print(f"Сборка lazy_extractors: {'есть' if lazy else 'нет (импорт yt_dlp будет заметно дольше)'}")
+
+    print(f"{'сценарий':<26}{'мин, мс':>10}{'медиана, мс':>14}  примечание")
+    for name, arguments in SCENARIOS:
+        timings, returncode = measure(arguments, args.repeat)
+        note = ""
+        if name == "import Downloader":
+            note = "yt_dlp импортирован!" if returncode == 3 else "yt_dlp не импортирован"
+        elif returncode:
+            note = f"код возврата {returncode}"
+        if name.startswith(("import Downloader", "Downloader.py")):
+            note += f"{'; ' if note else ''}{'OK' if min(timings) < TARGET_MS else 'медленнее'} {TARGET_MS} мс"
+        print(f"{name:<26}{min(timings):>10.1f}{statistics.median(timings):>14.1f}  {note}")
+
+
+if __name__ == "__main__":
+    main()
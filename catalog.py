@@ -0,0 +1,302 @@
+"""
+Каталог скачанных файлов (SQLite).
+
+Хранит для каждого файла источник, ID и название ролика, путь, размер, формат,
+хэш содержимого, результат проверки и временные метки. Строки пишет конвейер
+загрузки, а sync() поддерживает каталог в актуальном состоянии инкрементальным
+сканированием: перечитываются только папки, у которых изменилось mtime.
+
+Файлы, скачанные воркерами распределённого режима, записываются с именем
+воркера (колонка worker) и путём на его машине. Сканирование их не трогает,
+а запросы по умолчанию возвращают только локальные файлы.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+# Константы
+CATALOG_FILENAME = "catalog.sqlite3"  # Имя файла каталога в папке загрузок
+SETTLE_SECONDS = 2  # mtime папки моложе этого не запоминается (изменения в пределах одного тика)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    path TEXT PRIMARY KEY,
+    url TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    duration REAL,
+    status TEXT,
+    verified_at REAL
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime INTEGER
+);
+"""
+
+# Колонки, добавленные после первой версии схемы: имя -> тип
+ITEM_COLUMNS = {
+    "dir": "TEXT",
+    "video_id": "TEXT",
+    "title": "TEXT",
+    "ext": "TEXT",
+    "mtime": "INTEGER",
+    "downloaded_at": "REAL",
+    "scanned_at": "REAL",
+    "worker": "TEXT",  # Воркер, на машине которого лежит файл; NULL — локальный файл
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS items_dir ON items (dir);
+CREATE INDEX IF NOT EXISTS items_ext ON items (ext);
+CREATE INDEX IF NOT EXISTS items_url ON items (url);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+"""
+
+
+def file_ext(path):
+    return os.path.splitext(path)[1][1:].lower()
+
+
+def subtree_condition(root):
+    """Условие SQL «файл лежит в папке root или глубже» и его параметры."""
+    root = os.path.abspath(root)
+    escaped = root.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    separator = os.sep.replace('\\', '\\\\')
+    return "(dir = ? OR dir LIKE ? ESCAPE '\\')", [root, escaped + separator + '%']
+
+
+class DownloadCatalog:
+    """Потокобезопасная обёртка над базой каталога."""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+        self.connection.executescript(INDEXES)
+        self.connection.commit()
+
+    def _migrate(self):
+        """Добавляет недостающие колонки в каталог, созданный старой версией."""
+        existing = {row["name"] for row in self.connection.execute("PRAGMA table_info(items)")}
+        for name, kind in ITEM_COLUMNS.items():
+            if name not in existing:
+                self.connection.execute(f"ALTER TABLE items ADD COLUMN {name} {kind}")
+        if "dir" not in existing:
+            rows = self.connection.execute("SELECT path FROM items").fetchall()
+            self.connection.executemany(
+                "UPDATE items SET dir = ?, ext = ? WHERE path = ?",
+                [(os.path.dirname(row["path"]), file_ext(row["path"]), row["path"]) for row in rows],
+            )
+
+    # --- Запись ---
+
+    def record_download(self, path, url, info=None, worker=None):
+        """
+        Сохраняет файл, только что скачанный конвейером.
+        worker — имя воркера распределённого режима, если файл лежит на его машине.
+        """
+        info = info or {}
+        size, mtime = info.get("filesize"), None
+        if worker is None:
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+                size, mtime = stat.st_size, stat.st_mtime_ns
+            except OSError:
+                pass
+        # Файл воркера лежит на другой машине: путь сохраняем как есть, размер — из сведений воркера
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO items (path, dir, url, video_id, title, ext, size, mtime, duration, downloaded_at, "
+                "worker) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET url = excluded.url, video_id = excluded.video_id, "
+                "title = excluded.title, ext = excluded.ext, size = excluded.size, mtime = excluded.mtime, "
+                "duration = COALESCE(items.duration, excluded.duration), downloaded_at = excluded.downloaded_at, "
+                "worker = excluded.worker",
+                (path, os.path.dirname(path), url, info.get("id"), info.get("title"), file_ext(path),
+                 size, mtime, info.get("duration"), time.time(), worker),
+            )
+            self.connection.commit()
+
+    def postprocessor_hook(self, url):
+        """Хук postprocessor_hooks yt-dlp: заносит готовый файл в каталог."""
+        def _hook(d):
+            if d.get("postprocessor") == "MoveFiles" and d.get("status") == "finished":
+                info = d.get("info_dict") or {}
+                if info.get("filepath"):
+                    self.record_download(info["filepath"], url, info)
+        return _hook
+
+    def record_verification(self, path, url, size, sha256, duration, status, worker=None):
+        """Сохраняет результат проверки файла (worker — как в record_download)."""
+        if worker is None:
+            path = os.path.abspath(path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO items (path, dir, ext, url, size, sha256, duration, status, verified_at, worker) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET url = COALESCE(items.url, excluded.url), size = excluded.size, "
+                "sha256 = excluded.sha256, duration = COALESCE(excluded.duration, items.duration), "
+                "status = excluded.status, verified_at = excluded.verified_at, worker = excluded.worker",
+                (path, os.path.dirname(path), file_ext(path), url, size, sha256, duration, status, time.time(),
+                 worker),
+            )
+            self.connection.commit()
+
+    def record_file(self, path):
+        """Добавляет или обновляет файл, созданный не загрузчиком (например, после конвертации)."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO items (path, dir, ext, size, mtime, scanned_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                "scanned_at = excluded.scanned_at",
+                (path, os.path.dirname(path), file_ext(path), stat.st_size, stat.st_mtime_ns, time.time()),
+            )
+            self.connection.commit()
+
+    def remove(self, path):
+        with self.lock:
+            self.connection.execute("DELETE FROM items WHERE path = ?", (os.path.abspath(path),))
+            self.connection.commit()
+
+    # --- Инкрементальное сканирование ---
+
+    def sync(self, root, skip_names=()):
+        """
+        Приводит каталог в соответствие с деревом `root`.
+        Папка перечитывается, только если её mtime отличается от сохранённого,
+        иначе её подпапки берутся из каталога без обращения к диску.
+        Возвращает (просмотрено папок, перечитано папок, изменено файлов).
+        """
+        root = os.path.abspath(root)
+        skip_names = set(skip_names)
+        with self.lock:
+            known = {row["path"]: row["mtime"] for row in self.connection.execute("SELECT path, mtime FROM dirs")}
+            children = {}
+            for row in self.connection.execute("SELECT path, parent FROM dirs"):
+                children.setdefault(row["parent"], []).append(row["path"])
+
+            now = time.time()
+            seen = set()
+            visited = rescanned = changed = 0
+            stack = [root]
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(directory)
+                visited += 1
+                if known.get(directory) == mtime:
+                    stack.extend(children.get(directory, ()))
+                    continue
+
+                rescanned += 1
+                files = {}
+                subdirs = []
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                            elif entry.is_file() and entry.name not in skip_names:
+                                stat = entry.stat()
+                                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    continue
+
+                existing = {
+                    row["path"]: (row["size"], row["mtime"])
+                    for row in self.connection.execute("SELECT path, size, mtime FROM items WHERE dir = ? AND worker IS NULL",
+                                                       (directory,))
+                }
+                removed = [(path,) for path in existing if path not in files]
+                upserts = [
+                    (path, directory, file_ext(path), size, file_mtime, now)
+                    for path, (size, file_mtime) in files.items()
+                    if existing.get(path) != (size, file_mtime)
+                ]
+                self.connection.executemany("DELETE FROM items WHERE path = ?", removed)
+                self.connection.executemany(
+                    "INSERT INTO items (path, dir, ext, size, mtime, scanned_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                    "scanned_at = excluded.scanned_at",
+                    upserts,
+                )
+                changed += len(removed) + len(upserts)
+
+                # Слишком свежий mtime не запоминаем: папка могла измениться в том же тике
+                settled = mtime if now - mtime / 1e9 > SETTLE_SECONDS else None
+                parent = os.path.dirname(directory) if directory != root else None
+                self.connection.execute(
+                    "INSERT INTO dirs (path, parent, mtime) VALUES (?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET parent = excluded.parent, mtime = excluded.mtime",
+                    (directory, parent, settled),
+                )
+                stack.extend(subdirs)
+
+            # Папки, исчезнувшие с диска, удаляем вместе с их файлами
+            prefix = root + os.sep
+            vanished = [(path,) for path in known if (path == root or path.startswith(prefix)) and path not in seen]
+            self.connection.executemany("DELETE FROM items WHERE dir = ? AND worker IS NULL", vanished)
+            self.connection.executemany("DELETE FROM dirs WHERE path = ?", vanished)
+            self.connection.commit()
+        return visited, rescanned, changed
+
+    # --- Запросы ---
+
+    def query(self, root=None, ext=None, status=None, limit=None, remote=False):
+        """
+        Возвращает строки каталога (sqlite3.Row) с фильтрами по папке, расширению и статусу.
+        Файлы на машинах воркеров включаются только при remote=True.
+        """
+        conditions, params = [], []
+        if not remote:
+            conditions.append("worker IS NULL")
+        if root is not None:
+            condition, condition_params = subtree_condition(root)
+            conditions.append(condition)
+            params.extend(condition_params)
+        if ext is not None:
+            conditions.append("ext = ?")
+            params.append(ext.lower().lstrip('.'))
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        sql = "SELECT * FROM items"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def format_counts(self, root=None):
+        """Возвращает [(расширение, количество, суммарный размер)] локальных файлов по убыванию количества."""
+        sql = "SELECT ext, COUNT(*) AS count, COALESCE(SUM(size), 0) AS size FROM items WHERE worker IS NULL"
+        params = []
+        if root is not None:
+            condition, params = subtree_condition(root)
+            sql += " AND " + condition
+        sql += " GROUP BY ext ORDER BY count DESC"
+        with self.lock:
+            return [(row["ext"], row["count"], row["size"]) for row in self.connection.execute(sql, params)]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
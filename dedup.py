@@ -0,0 +1,216 @@
+"""
+Поиск дубликатов по содержимому для организаторов (update.py, del meta.py).
+
+Поиск идёт в три ступени, каждая отсеивает большинство кандидатов для следующей:
+1. размер: файл с уникальным размером не может быть дубликатом;
+2. частичный хэш: SHA-256 размера, начала и конца файла (PARTIAL_BLOCK байт с каждой стороны);
+3. полный SHA-256 — только для совпавших частичных хэшей, в пуле процессов.
+
+Хэши разложенных файлов сохраняются в индексе (SQLite) в результирующей папке,
+поэтому следующие запуски находят дубликаты и среди уже разложенных файлов.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from verify import file_sha256
+
+# Константы
+INDEX_FILENAME = ".dedup_index.sqlite3"  # Индекс хэшей в результирующей папке
+PARTIAL_BLOCK = 64 * 1024  # Байт с начала и с конца файла для частичного хэша
+PARTIAL_WORKERS = 8  # Потоков для частичных хэшей (упираются в диск)
+FULL_HASH_WORKERS = None  # Процессов для полных хэшей (None — по числу ядер)
+DUPLICATE_POLICIES = ("skip", "hardlink", "report")  # Что делать с найденными дубликатами
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    partial TEXT,
+    full TEXT,
+    exact INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+"""
+
+
+def partial_hash(path, size):
+    """
+    Частичный хэш файла. Файл не длиннее двух блоков читается целиком,
+    и тогда результат совпадает с полным SHA-256.
+    """
+    if size <= 2 * PARTIAL_BLOCK:
+        return file_sha256(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as file:
+        digest.update(file.read(PARTIAL_BLOCK))
+        file.seek(-PARTIAL_BLOCK, os.SEEK_END)
+        digest.update(file.read(PARTIAL_BLOCK))
+    return digest.hexdigest()
+
+
+def _partial_or_none(path, size):
+    try:
+        return partial_hash(path, size)
+    except OSError:
+        return None  # Файл исчез или недоступен: в поиске дубликатов не участвует
+
+
+def _full_or_none(path):
+    try:
+        return file_sha256(path)
+    except OSError:
+        return None
+
+
+class DedupIndex:
+    """
+    Индекс хэшей разложенных файлов. Потокобезопасен.
+
+    exact=1 — файл в результате побайтно совпадает с исходником, его хэши можно
+    досчитать позже по самому файлу; exact=0 — очищенная копия (del meta.py),
+    для неё хранятся хэши исходника, и без них строка не записывается.
+    """
+
+    def __init__(self, result_directory):
+        self.path = os.path.join(result_directory, INDEX_FILENAME)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def rows_of_size(self, sizes):
+        """Возвращает строки индекса для указанных размеров."""
+        sizes = list(sizes)
+        rows = []
+        with self.lock:
+            for start in range(0, len(sizes), 500):
+                batch = sizes[start:start + 500]
+                rows.extend(self.connection.execute(
+                    f"SELECT * FROM files WHERE size IN ({', '.join('?' * len(batch))}) ORDER BY rowid", batch))
+        return rows
+
+    def add(self, path, size, partial=None, full=None, exact=True):
+        if not exact and full is None:
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (path, size, partial, full, exact) VALUES (?, ?, ?, ?, ?)",
+                (os.path.abspath(path), size, partial, full, int(exact)))
+
+    def set_hashes(self, path, partial, full):
+        with self.lock:
+            self.connection.execute("UPDATE files SET partial = COALESCE(?, partial), full = COALESCE(?, full) "
+                                    "WHERE path = ?", (partial, full, path))
+
+    def remove(self, path):
+        with self.lock:
+            self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+def _alive(row):
+    """Проверяет, что файл из индекса ещё на месте и не изменился в размере."""
+    try:
+        size = os.stat(row["path"]).st_size
+    except OSError:
+        return False
+    return size == row["size"] or not row["exact"]
+
+
+def find_duplicates(items, index=None, partial_workers=PARTIAL_WORKERS, full_workers=FULL_HASH_WORKERS):
+    """
+    Ищет дубликаты среди файлов items — списка (путь, размер) в порядке обработки —
+    и среди файлов индекса.
+
+    Оригиналом считается файл из индекса, а если его нет — первый файл группы в items.
+    Пустые файлы не рассматриваются.
+
+    :return: (словарь {путь дубликата: путь оригинала},
+              словарь {путь: (частичный хэш, полный хэш или None)} для всех хэшированных файлов из items)
+    """
+    order = {}
+    sizes = {}
+    by_size = defaultdict(list)
+    for position, (path, size) in enumerate(items):
+        if size:
+            order[path] = position
+            sizes[path] = size
+            by_size[size].append(path)
+
+    # Файлы индекса тех же размеров: {путь: [размер, частичный, полный, exact]} в порядке добавления
+    known = {}
+    if index is not None and by_size:
+        for row in index.rows_of_size(by_size):
+            if _alive(row):
+                known[row["path"]] = [row["size"], row["partial"], row["full"], row["exact"]]
+            else:
+                index.remove(row["path"])
+    known_sizes = defaultdict(int)
+    for entry in known.values():
+        known_sizes[entry[0]] += 1
+
+    def size_of(path):
+        return sizes[path] if path in sizes else known[path][0]
+
+    # Ступень 1: размер
+    candidates = [path for size, paths in by_size.items() if len(paths) + known_sizes[size] > 1 for path in paths]
+    if not candidates:
+        return {}, {}
+    hashes = {path: [None, None] for path in candidates}
+
+    # Ступень 2: частичный хэш (чтение начала и конца файла, в потоках)
+    stale = [path for path, entry in known.items() if entry[1] is None and entry[3]]
+    jobs = candidates + stale
+    with ThreadPoolExecutor(max_workers=partial_workers) as executor:
+        partials = list(executor.map(lambda path: _partial_or_none(path, size_of(path)), jobs))
+    for path, value in zip(jobs, partials):
+        full = value if size_of(path) <= 2 * PARTIAL_BLOCK else None
+        if path in hashes:
+            hashes[path] = [value, full]
+        else:
+            known[path][1:3] = [value, full]
+            index.set_hashes(path, value, full)
+
+    groups = defaultdict(list)
+    for path in candidates:
+        if hashes[path][0] is not None:
+            groups[(sizes[path], hashes[path][0])].append(path)
+    for path, entry in known.items():
+        if entry[1] is not None:
+            groups[(entry[0], entry[1])].append(path)
+
+    # Ступень 3: полный хэш (в пуле процессов) только внутри групп с совпавшим частичным хэшем
+    jobs = []
+    for members in groups.values():
+        if len(members) > 1 and any(path in hashes for path in members):
+            jobs.extend(path for path in members if path in hashes and hashes[path][1] is None
+                        or path in known and known[path][2] is None and known[path][3])
+    if jobs:
+        with ProcessPoolExecutor(max_workers=full_workers) as executor:
+            fulls = list(executor.map(_full_or_none, jobs, chunksize=16))
+        for path, value in zip(jobs, fulls):
+            if path in hashes:
+                hashes[path][1] = value
+            else:
+                known[path][2] = value
+                index.set_hashes(path, None, value)
+
+    # Группировка по полному хэшу: оригинал — первый файл из индекса, иначе первый по порядку
+    originals = {}
+    for path, entry in known.items():
+        if entry[2] is not None:
+            originals.setdefault((entry[0], entry[2]), path)
+    duplicates = {}
+    for path in sorted((path for path in candidates if hashes[path][1] is not None), key=order.get):
+        original = originals.setdefault((sizes[path], hashes[path][1]), path)
+        if original != path:
+            duplicates[path] = original
+    return duplicates, {path: tuple(value) for path, value in hashes.items()}
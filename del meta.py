@@ -1,11 +1,9 @@
 import os
 from pathlib import Path
 from datetime import datetime
-from PIL import Image
-import PyPDF2
-import shutil
 import platform
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import itertools
 import multiprocessing
 import pywintypes
 import win32file
@@ -13,6 +11,15 @@ import win32con
 from threading import Lock
 import time
 import tempfile
+from dedup import DUPLICATE_POLICIES, DedupIndex, find_duplicates
+from fileops import move_file
+from journal import MoveJournal
+from mediastrip import MEDIA_SUFFIXES, strip_media_in_place
+from metastrip import CLEAN_COPY_SUFFIXES, create_clean_copy, needs_stripping
+from scanner import merged_files
+
+# Константы
+SUBMIT_WINDOW = 1000  # Файлов в работе и в очереди пулов одновременно (память не растёт с размером свалки)
 
 
 class FileOrganizer:
@@ -22,24 +29,41 @@ class FileOrganizer:
     """
 
     def __init__(self, source_directory, result_directory, max_files_per_folder=5000,
-                 start_number=None, remove_meta=True, wipe_timestamps=True, max_workers=None):
-        self.source = Path(source_directory)
+                 start_number=None, remove_meta=True, wipe_timestamps=True, max_workers=None,
+                 duplicates=None, cpu_workers=None):
+        # Одна папка-источник или список папок, файлы которых нумеруются общей последовательностью
+        if isinstance(source_directory, (list, tuple)):
+            self.sources = [Path(directory) for directory in source_directory]
+        else:
+            self.sources = [Path(source_directory)]
         self.result = Path(result_directory)
         self.max_files_per_folder = max_files_per_folder
         self.start_number = start_number
         self.remove_meta = remove_meta
         self.wipe_timestamps = wipe_timestamps
         self.max_workers = max_workers or min(multiprocessing.cpu_count() * 2, 16)
+        # Процессов для очистки метаданных (перекодирование упирается в процессор и GIL)
+        self.cpu_workers = cpu_workers or multiprocessing.cpu_count()
+        self.strip_pool = None
+        self.duplicates = duplicates  # None, "skip", "hardlink" или "report" (см. dedup.py)
 
         # Потокобезопасные счетчики
         self.lock = Lock()
         self.file_counter = 0
         self.folder_counter = 1
-        self.current_folder = None
         self.processed_count = 0
         self.metadata_removed_count = 0
+        self.already_clean_count = 0
         self.timestamp_wiped_count = 0
         self.error_count = 0
+        self.duplicate_count = 0
+        self.journal = None
+
+        # Поиск дубликатов: {дубликат: оригинал}, хэши исходников и {исходник оригинала: новый путь}
+        self.dedup_index = None
+        self.duplicate_of = {}
+        self.hashes = {}
+        self.placed = {}
 
     def wipe_file_timestamps_windows(self, file_path):
         """Затирает временные метки файла на Windows."""
@@ -85,110 +109,114 @@ class FileOrganizer:
 
     def create_clean_copy(self, source_path, dest_path):
         """
-        Создаёт чистую копию файла без метаданных.
-        Исходный файл НЕ изменяется.
-        Возвращает True если метаданные были удалены.
+        Создаёт чистую копию файла без метаданных (см. metastrip.create_clean_copy).
+        Если запущен пул процессов, работа выполняется в нём, а вызывающий поток ждёт результат.
         """
-        try:
-            suffix = source_path.suffix.lower()
-
-            # Обработка изображений - создаём временную чистую копию
-            if suffix in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.webp']:
-                with Image.open(source_path) as img:
-                    # Сохраняем БЕЗ метаданных в целевой файл
-                    if suffix in ['.jpg', '.jpeg']:
-                        img.save(dest_path, 'JPEG', quality=95, optimize=False, exif=b'')
-                    elif suffix == '.png':
-                        img.save(dest_path, 'PNG', optimize=False)
-                    else:
-                        # Создаем новое изображение без EXIF
-                        data = list(img.getdata())
-                        clean_img = Image.new(img.mode, img.size)
-                        clean_img.putdata(data)
-                        clean_img.save(dest_path)
-                return True
+        if self.strip_pool is None:
+            return create_clean_copy(source_path, dest_path)
+        return self.strip_pool.submit(create_clean_copy, str(source_path), str(dest_path)).result()
 
-            # Обработка PDF - создаём чистую копию
-            elif suffix == '.pdf':
-                try:
-                    with open(source_path, 'rb') as input_file:
-                        reader = PyPDF2.PdfReader(input_file)
-                        writer = PyPDF2.PdfWriter()
-
-                        # Копируем страницы без метаданных
-                        for page in reader.pages:
-                            writer.add_page(page)
+    def assign_slots(self, files):
+        """
+        Распределяет номера и папки файлам в порядке потока files в вызывающем
+        потоке, поэтому рабочие потоки не берут общую блокировку и не читают папки.
+        Последняя существующая папка читается один раз, конфликты имён
+        разрешаются по снимку её имён, новые папки создаются по мере заполнения.
 
-                        # Сохраняем чистый PDF
-                        with open(dest_path, 'wb') as output_file:
-                            writer.write(output_file)
-                    return True
-                except:
-                    # Если не получилось - просто копируем
-                    shutil.copy2(source_path, dest_path)
-                    return False
+        :return: Генератор пар (файл, новый путь).
+        """
+        folder_number = self.folder_counter
+        folder = self.result / f"{folder_number:04d}"
+        folder.mkdir(parents=True, exist_ok=True)
+        names = {os.path.normcase(name) for name in os.listdir(folder)}
+        for file in files:
+            while len(names) >= self.max_files_per_folder:
+                folder_number += 1
+                self.folder_counter = folder_number
+                folder = self.result / f"{folder_number:04d}"
+                folder.mkdir(parents=True, exist_ok=True)
+                names = {os.path.normcase(name) for name in os.listdir(folder)}
 
-            # Для остальных файлов - обычное копирование
-            else:
-                shutil.copy2(source_path, dest_path)
-                return False
+            self.file_counter += 1
+            new_name = f"{self.file_counter:06d}{file.suffix}"
+            conflict_counter = 0
+            while os.path.normcase(new_name) in names:
+                conflict_counter += 1
+                new_name = f"{self.file_counter:06d}_{conflict_counter}{file.suffix}"
+            names.add(os.path.normcase(new_name))
+            yield file, folder / new_name
 
-        except Exception as e:
-            # При ошибке пытаемся хотя бы скопировать файл
-            try:
-                if not dest_path.exists():
-                    shutil.copy2(source_path, dest_path)
-            except:
-                pass
+    def needs_clean_copy(self, file_path):
+        """True, если для файла создаётся чистая копия (нагрузка на процессор), а не перемещение."""
+        if self.duplicates == "hardlink" and str(file_path) in self.duplicate_of:
             return False
+        return self.remove_meta and file_path.suffix.lower() in CLEAN_COPY_SUFFIXES
 
-    def get_next_folder(self):
-        """Получает следующую папку для размещения файлов (потокобезопасно)."""
-        with self.lock:
-            if self.current_folder is None or len(list(self.current_folder.iterdir())) >= self.max_files_per_folder:
-                self.folder_counter += 1
-                self.current_folder = self.result / f"{self.folder_counter:04d}"
-                if not self.current_folder.exists():
-                    self.current_folder.mkdir(parents=True)
-            return self.current_folder
-
-    def get_next_file_number(self):
-        """Получает следующий номер файла (потокобезопасно)."""
-        with self.lock:
-            self.file_counter += 1
-            return self.file_counter
-
-    def process_file(self, file_path):
+    def process_file(self, file_path, new_path):
         """
-        Обрабатывает один файл: создаёт чистую копию, переименовывает, удаляет оригинал.
+        Обрабатывает один файл: создаёт чистую копию под заранее выбранным путём
+        new_path (см. assign_slots), удаляет оригинал.
         Операция перемещения с очисткой метаданных.
         """
         try:
-            # Получаем номер и папку
-            file_number = self.get_next_file_number()
-            target_folder = self.get_next_folder()
-
-            # Формируем путь
-            new_name = f"{file_number:06d}{file_path.suffix}"
-            new_path = target_folder / new_name
+            stat = file_path.stat()
+            original = self.duplicate_of.get(str(file_path))
+            if original is not None and self.duplicates == "report":
+                print(f"Дубликат: {file_path} = {self.placed.get(original, original)}")
+
+            # Дубликат раскладываем жёсткой ссылкой на уже разложенный оригинал
+            if original is not None and self.duplicates == "hardlink":
+                if self.journal is not None:
+                    self.journal.record(file_path, new_path, stat.st_mtime, kind="link")
+                try:
+                    os.link(self.placed.get(original, original), new_path)
+                except OSError:
+                    pass  # ФС без жёстких ссылок: раскладываем как обычный файл
+                else:
+                    file_path.unlink()
+                    with self.lock:
+                        self.duplicate_count += 1
+                        self.processed_count += 1
+                    return True
 
-            # Проверяем конфликты
-            conflict_counter = 0
-            while new_path.exists():
-                conflict_counter += 1
-                new_name = f"{file_number:06d}_{conflict_counter}{file_path.suffix}"
-                new_path = target_folder / new_name
+            # Чистая копия нужна только для форматов с метаданными и только если они действительно есть
+            # (проверка по заголовкам), остальные файлы перемещаются
+            clean_copy = self.remove_meta and file_path.suffix.lower() in CLEAN_COPY_SUFFIXES
+            if clean_copy and not needs_stripping(file_path):
+                clean_copy = False
+                with self.lock:
+                    self.already_clean_count += 1
+            # Аудио и видео перемещаются и очищаются на месте: правка контейнера — работа диска,
+            # а чистая копия многогигабайтного файла удвоила бы запись и место
+            strip_media = self.remove_meta and file_path.suffix.lower() in MEDIA_SUFFIXES
+            if strip_media and not needs_stripping(file_path):
+                strip_media = False
+                with self.lock:
+                    self.already_clean_count += 1
+
+            # Записываем перемещение в журнал до выполнения (для отмены запуска)
+            if self.journal is not None:
+                self.journal.record(file_path, new_path, stat.st_mtime,
+                                    kind="copy" if clean_copy else "move")
 
             # Создаём чистую копию
             meta_removed = False
-            if self.remove_meta:
+            if clean_copy:
                 meta_removed = self.create_clean_copy(file_path, new_path)
                 if meta_removed:
                     with self.lock:
                         self.metadata_removed_count += 1
             else:
-                # Если не нужно удалять метаданные - просто копируем
-                shutil.copy2(file_path, new_path)
+                # Переименование в пределах тома, иначе копирование ядром с проверкой размера
+                move_file(file_path, new_path)
+                if strip_media:
+                    try:
+                        meta_removed = strip_media_in_place(new_path)
+                    except (OSError, ValueError) as e:
+                        print(f"⚠️  Не удалось очистить метаданные {new_path}: {e}")
+                    if meta_removed:
+                        with self.lock:
+                            self.metadata_removed_count += 1
 
             # Затираем временные метки на копии
             timestamp_wiped = False
@@ -199,21 +227,29 @@ class FileOrganizer:
                         self.timestamp_wiped_count += 1
 
             # Удаляем оригинал после успешного копирования
-            try:
-                file_path.unlink()
-            except Exception as e:
-                # Если не удалось удалить - не критично, продолжаем
-                pass
+            if clean_copy:
+                try:
+                    file_path.unlink()
+                except Exception as e:
+                    # Если не удалось удалить - не критично, продолжаем
+                    pass
+
+            # Хэши исходника — в индекс, чтобы следующие запуски находили его дубликаты
+            if self.dedup_index is not None and original is None:
+                partial, full = self.hashes.get(str(file_path), (None, None))
+                self.dedup_index.add(new_path, stat.st_size, partial, full, exact=not (clean_copy or meta_removed))
 
             with self.lock:
                 self.processed_count += 1
+                if original is None and self.hashes.get(str(file_path), (None, None))[1] is not None:
+                    self.placed[str(file_path)] = str(new_path)
 
-            return True, file_number
+            return True
 
         except Exception as e:
             with self.lock:
                 self.error_count += 1
-            return False, None
+            return False
 
     def organize_files(self):
         """Главная функция с оптимизацией."""
@@ -221,12 +257,17 @@ class FileOrganizer:
             start_time = time.time()
 
             # Проверки
-            if not self.source.exists() or not self.source.is_dir():
-                print(f"❌ Ошибка: Папка '{self.source}' не существует.")
-                return
+            for source in self.sources:
+                if not source.exists() or not source.is_dir():
+                    print(f"❌ Ошибка: Папка '{source}' не существует.")
+                    return
 
-            if self.source == self.result:
-                print(f"❌ Ошибка: Папка-источник и результат не могут совпадать!")
+                if source == self.result:
+                    print(f"❌ Ошибка: Папка-источник и результат не могут совпадать!")
+                    return
+
+            if self.duplicates is not None and self.duplicates not in DUPLICATE_POLICIES:
+                print(f"❌ Ошибка: Неизвестный режим дубликатов '{self.duplicates}'.")
                 return
 
             if not self.result.exists():
@@ -235,20 +276,39 @@ class FileOrganizer:
 
             # Сканирование
             print("📂 Сканирование файлов...")
-            files = [f for f in self.source.iterdir() if f.is_file()]
-
-            if not files:
+            # Сортировка по (дата изменения, имя) по данным одного scandir, без повторных stat()
+            # Несколько источников сливаются по отсортированным потокам в общий порядок
+            records = merged_files(self.sources)
+            first = next(records, None)
+            if first is None:
                 print("⚠️  Нет файлов для обработки.")
                 return
-
-            # Сортировка
-            files.sort(key=lambda f: (f.stat().st_mtime, f.name.lower()))
-            total_files = len(files)
-            print(f"✓ Найдено файлов: {total_files}")
+            records = itertools.chain([first], records)
+
+            # Поиск дубликатов по содержимому: размер -> частичный хэш -> полный хэш.
+            # Ему нужен весь список файлов; без него файлы идут в обработку прямо из сканера.
+            total_files = None
+            if self.duplicates is not None:
+                records = list(records)
+                files = [source / record.name for source, record in records]
+                print("🔍 Поиск дубликатов...")
+                self.dedup_index = DedupIndex(self.result)
+                self.duplicate_of, self.hashes = find_duplicates(
+                    [(str(file), record.size) for file, (_, record) in zip(files, records)], self.dedup_index)
+                print(f"✓ Найдено дубликатов: {len(self.duplicate_of)}")
+                if self.duplicates == "skip":
+                    files = [file for file in files if str(file) not in self.duplicate_of]
+                total_files = len(files)
+                print(f"✓ Найдено файлов: {total_files}")
+            else:
+                files = (source / record.name for source, record in records)
+                print("✓ Файлы передаются в обработку по мере сканирования")
+            del records
 
             # Начальный номер
             if self.start_number is None:
-                existing_folders = sorted(self.result.glob("*/"), key=lambda f: f.name)
+                existing_folders = sorted((f for f in self.result.glob("*/") if f.name.isdigit()),
+                                          key=lambda f: f.name)
                 if existing_folders:
                     last_folder = existing_folders[-1]
                     try:
@@ -265,25 +325,26 @@ class FileOrganizer:
             else:
                 self.file_counter = self.start_number - 1
 
-            # Инициализация папки
-            existing_folders = sorted(self.result.glob("*/"), key=lambda f: f.name)
+            # Инициализация папки: дописываем последнюю существующую
+            existing_folders = sorted((f for f in self.result.glob("*/") if f.name.isdigit()),
+                                      key=lambda f: f.name)
             if existing_folders:
-                last_folder = existing_folders[-1]
-                self.folder_counter = int(last_folder.name) - 1
+                self.folder_counter = int(existing_folders[-1].name)
             else:
-                self.folder_counter = 0
-
-            self.get_next_folder()
+                self.folder_counter = 1
 
             # Информация
             print(f"\n{'=' * 80}")
             print(f"ПАРАМЕТРЫ ОБРАБОТКИ:")
-            print(f"Источник: {self.source}")
+            print(f"Источник: {', '.join(str(source) for source in self.sources)}")
             print(f"Назначение: {self.result}")
             print(f"Файлов на папку: {self.max_files_per_folder}")
             print(f"Потоков: {self.max_workers}")
+            if self.remove_meta:
+                print(f"Процессов очистки метаданных: {self.cpu_workers}")
             print(f"Удаление метаданных: {'Да' if self.remove_meta else 'Нет'}")
             print(f"Затирание временных меток: {'Да' if self.wipe_timestamps else 'Нет'}")
+            print(f"Дубликаты: {self.duplicates or 'не искать'}")
             print(f"⚠️  ОПЕРАЦИЯ ПЕРЕМЕЩЕНИЯ: исходные файлы будут удалены после копирования")
             print(f"{'=' * 80}\n")
 
@@ -291,24 +352,62 @@ class FileOrganizer:
             print("🚀 Запуск обработки...")
             print(f"{'-' * 80}")
 
-            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                futures = {executor.submit(self.process_file, file): file for file in files}
-
-                last_update = time.time()
-                for future in as_completed(futures):
-                    # Обновляем прогресс
-                    current_time = time.time()
-                    if (current_time - last_update > 2) or (self.processed_count % 100 == 0) or (
-                            self.processed_count == total_files):
-                        percent = (self.processed_count / total_files) * 100
-                        elapsed = current_time - start_time
-                        speed = self.processed_count / elapsed if elapsed > 0 else 0
-
-                        print(f"Прогресс: {self.processed_count}/{total_files} ({percent:.1f}%) | "
-                              f"Скорость: {speed:.1f} ф/с | "
-                              f"Метаданные: {self.metadata_removed_count} | "
-                              f"Ошибки: {self.error_count}")
-                        last_update = current_time
+            # Журнал перемещений: прерванный запуск можно отменить командой python journal.py undo <результат>
+            self.journal = MoveJournal(self.result, "del_meta")
+            print(f"Журнал перемещений: {self.journal.path}")
+
+            # Номера и папки распределяются в порядке сортировки по мере подачи файлов.
+            # Для жёстких ссылок дубликаты обрабатываются после оригиналов.
+            batches = [self.assign_slots(files)]
+            if self.duplicates == "hardlink":
+                slots = list(self.assign_slots(files))
+                batches = [[slot for slot in slots if str(slot[0]) not in self.duplicate_of],
+                           [slot for slot in slots if str(slot[0]) in self.duplicate_of]]
+
+            last_update = time.time()
+
+            def report_progress():
+                # Обновляем прогресс
+                nonlocal last_update
+                current_time = time.time()
+                if (current_time - last_update > 2) or (self.processed_count % 100 == 0) or (
+                        self.processed_count == total_files):
+                    elapsed = current_time - start_time
+                    speed = self.processed_count / elapsed if elapsed > 0 else 0
+                    done = f"{self.processed_count}"
+                    if total_files:
+                        done += f"/{total_files} ({self.processed_count / total_files * 100:.1f}%)"
+                    print(f"Прогресс: {done} | "
+                          f"Скорость: {speed:.1f} ф/с | "
+                          f"Метаданные: {self.metadata_removed_count} | "
+                          f"Ошибки: {self.error_count}")
+                    last_update = current_time
+
+            # Очистка метаданных идёт в пуле процессов по числу ядер (он создаётся при первом таком
+            # файле). Такие файлы ведут отдельные потоки (по два на процесс): они ждут результат,
+            # поэтому в пуле процессов не больше 2 * cpu_workers задач, а простые перемещения
+            # не стоят за ними в очереди. В работе одновременно не больше SUBMIT_WINDOW файлов:
+            # следующий подаётся, когда завершился один из предыдущих.
+            submitted = 0
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor, \
+                    ThreadPoolExecutor(max_workers=self.cpu_workers * 2, thread_name_prefix="strip") as strip_executor:
+                for batch in batches:
+                    pending = set()
+                    for file, new_path in batch:
+                        if len(pending) >= SUBMIT_WINDOW:
+                            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            report_progress()
+                        clean_copy = self.needs_clean_copy(file)
+                        if clean_copy and self.strip_pool is None:
+                            self.strip_pool = ProcessPoolExecutor(max_workers=self.cpu_workers)
+                        pending.add((strip_executor if clean_copy else executor).submit(
+                            self.process_file, file, new_path))
+                        submitted += 1
+                    while pending:
+                        _, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        report_progress()
+            if total_files is None:
+                total_files = submitted
 
             # Статистика
             total_time = time.time() - start_time
@@ -320,17 +419,32 @@ class FileOrganizer:
             print(f"  Создано папок: {self.folder_counter}")
             if self.remove_meta:
                 print(f"  Метаданные удалены: {self.metadata_removed_count}")
+                print(f"  Уже без метаданных (перемещены без копирования): {self.already_clean_count}")
             if self.wipe_timestamps:
                 print(f"  Временные метки затерты: {self.timestamp_wiped_count}")
+            if self.duplicates == "skip":
+                print(f"  Дубликатов оставлено в источнике: {len(self.duplicate_of)}")
+            elif self.duplicates == "hardlink":
+                print(f"  Дубликатов разложено жёсткими ссылками: {self.duplicate_count}")
             print(f"  Ошибок: {self.error_count}")
             print(f"  Время работы: {total_time:.2f} сек ({total_time / 60:.1f} мин)")
             print(f"  Средняя скорость: {total_files / total_time:.1f} файлов/сек")
             print(f"\n✅ Файлы перемещены с очисткой метаданных")
-            print(f"📁 Исходная папка '{self.source}' очищена")
+            print(f"📁 Исходные папки очищены: {', '.join(str(source) for source in self.sources)}")
             print(f"{'=' * 80}")
 
         except Exception as e:
             print(f"💥 Критическая ошибка: {e}")
+        finally:
+            if self.strip_pool is not None:
+                self.strip_pool.shutdown()
+                self.strip_pool = None
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            if self.dedup_index is not None:
+                self.dedup_index.close()
+                self.dedup_index = None
 
 
 def interactive_mode():
@@ -339,10 +453,11 @@ def interactive_mode():
     print("ОРГАНИЗАТОР ФАЙЛОВ С ПЕРЕМЕЩЕНИЕМ И ОЧИСТКОЙ МЕТАДАННЫХ")
     print(f"{'=' * 80}\n")
 
-    source = input("Путь к папке-источнику: ").strip()
+    source_input = input("Путь к папке-источнику (несколько — через ';'): ").strip()
+    source = [path.strip() for path in source_input.split(';') if path.strip()]
     result = input("Путь к результирующей папке: ").strip()
 
-    if source == result:
+    if result in source:
         print("❌ Ошибка: Папки не должны совпадать!")
         return
 
@@ -361,6 +476,9 @@ def interactive_mode():
     workers_input = input("Количество потоков (Enter = авто): ").strip()
     max_workers = int(workers_input) if workers_input.isdigit() else None
 
+    duplicates_input = input("Дубликаты по содержимому (skip/hardlink/report, Enter = не искать): ").strip().lower()
+    duplicates = duplicates_input if duplicates_input in DUPLICATE_POLICIES else None
+
     print(f"\n⚠️  Начать обработку? (да/нет): ", end='')
     confirm = input().strip().lower()
 
@@ -368,7 +486,7 @@ def interactive_mode():
         print()
         organizer = FileOrganizer(
             source, result, max_files, start_number,
-            remove_meta, wipe_timestamps, max_workers
+            remove_meta, wipe_timestamps, max_workers, duplicates
         )
         organizer.organize_files()
     else:
@@ -389,6 +507,7 @@ if __name__ == "__main__":
         start_number=start_number,
         remove_meta=True,
         wipe_timestamps=True,
-        max_workers=None
+        max_workers=None,
+        duplicates=None
     )
     organizer.organize_files()
\ No newline at end of file
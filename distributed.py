@@ -0,0 +1,237 @@
+"""
+Очередь заданий для распределённой загрузки.
+
+Координатор записывает ссылки в файл SQLite на общем хранилище, а несколько
+экземпляров Downloader.py (на этой или других машинах) берут задания в аренду.
+Аренда продлевается heartbeat-ом; если воркер пропал, по истечении аренды
+задание возвращается в очередь и достаётся другому воркеру. Результаты (пути,
+размеры, хэши) воркеры пишут в ту же базу, а координатор сливает их в каталог.
+
+Внимание: блокировки SQLite на сетевых ФС (SMB, NFS) работают не везде;
+база должна лежать на хранилище с корректной блокировкой файлов.
+"""
+import os
+import socket
+import sqlite3
+import time
+
+# Константы
+LEASE_SECONDS = 120  # Срок аренды задания без heartbeat (сек)
+HEARTBEAT_INTERVAL = 15  # Период heartbeat воркера (сек)
+WORKER_TIMEOUT = 3 * HEARTBEAT_INTERVAL  # Воркер без heartbeat дольше этого считается мёртвым
+MAX_JOB_ATTEMPTS = 3  # Попыток на задание до статуса failed
+POLL_INTERVAL = 5  # Пауза воркера, когда свободных заданий нет (сек)
+BUSY_TIMEOUT = 60  # Ожидание блокировки базы (сек)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    playlist_start INTEGER,
+    playlist_end INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL,
+    UNIQUE (url, content_type)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    status TEXT,
+    started_at REAL,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER NOT NULL,
+    worker TEXT,
+    path TEXT NOT NULL,
+    url TEXT,
+    video_id TEXT,
+    title TEXT,
+    duration REAL,
+    size INTEGER,
+    sha256 TEXT,
+    status TEXT,
+    recorded_at REAL,
+    PRIMARY KEY (job_id, path)
+);
+"""
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class JobQueue:
+    """Очередь заданий в файле SQLite. Каждый поток должен открывать свой экземпляр."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _transaction(self):
+        """Транзакция с немедленной блокировкой на запись (исключает гонку при аренде)."""
+        queue = self
+
+        class Transaction:
+            def __enter__(self):
+                queue.connection.execute("BEGIN IMMEDIATE")
+                return queue.connection
+
+            def __exit__(self, exc_type, exc, tb):
+                queue.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+
+        return Transaction()
+
+    # --- Координатор ---
+
+    def seed(self, links, content_type, playlist_ranges=None):
+        """Добавляет ссылки в очередь; уже существующие задания не дублируются. Возвращает число новых."""
+        playlist_ranges = playlist_ranges or {}
+        now = time.time()
+        rows = []
+        for url in links:
+            start, end = playlist_ranges.get(url, (None, None))
+            rows.append((url, content_type, start, None if end == float('inf') else end, now))
+        with self._transaction() as connection:
+            before = connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            connection.executemany(
+                "INSERT OR IGNORE INTO jobs (url, content_type, playlist_start, playlist_end, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            return connection.execute("SELECT COUNT(*) FROM jobs").fetchone()[0] - before
+
+    def reclaim_expired(self):
+        """Возвращает в очередь задания с истёкшей арендой. Возвращает их число."""
+        with self._transaction() as connection:
+            return self._reclaim(connection, time.time())
+
+    @staticmethod
+    def _reclaim(connection, now):
+        cursor = connection.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, lease_until = NULL, error = 'аренда истекла', updated_at = ? "
+            "WHERE status = 'leased' AND lease_until < ?", (MAX_JOB_ATTEMPTS, now, now))
+        return cursor.rowcount
+
+    def counts(self):
+        """Возвращает {статус: число заданий}."""
+        return {row["status"]: row["count"] for row in
+                self.connection.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status")}
+
+    def workers(self):
+        return self.connection.execute("SELECT * FROM workers ORDER BY name").fetchall()
+
+    def results(self):
+        return self.connection.execute("SELECT * FROM results ORDER BY job_id, path").fetchall()
+
+    # --- Воркер ---
+
+    def register(self, name):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO workers (name, host, pid, status, started_at, heartbeat) VALUES (?, ?, ?, 'active', ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET status = 'active', pid = excluded.pid, "
+                "started_at = excluded.started_at, heartbeat = excluded.heartbeat",
+                (name, socket.gethostname(), os.getpid(), now, now))
+
+    def unregister(self, name):
+        with self._transaction() as connection:
+            connection.execute("UPDATE workers SET status = 'stopped', heartbeat = ? WHERE name = ?",
+                               (time.time(), name))
+
+    def heartbeat(self, name):
+        """Отмечает воркер живым и продлевает аренду его заданий."""
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE workers SET heartbeat = ?, status = 'active' WHERE name = ?", (now, name))
+            connection.execute("UPDATE jobs SET lease_until = ? WHERE status = 'leased' AND worker = ?",
+                               (now + LEASE_SECONDS, name))
+
+    def lease(self, name):
+        """Берёт в аренду следующее задание или возвращает None, если свободных нет."""
+        now = time.time()
+        with self._transaction() as connection:
+            self._reclaim(connection, now)
+            row = connection.execute("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE id = ?", (name, now + LEASE_SECONDS, now, row["id"]))
+            return dict(row)
+
+    def complete(self, job_id, name, ok, error=None):
+        """Завершает задание; неудачное возвращается в очередь, пока не кончатся попытки."""
+        now = time.time()
+        with self._transaction() as connection:
+            if ok:
+                status_sql = "'done'"
+            else:
+                status_sql = f"CASE WHEN attempts >= {MAX_JOB_ATTEMPTS} THEN 'failed' ELSE 'pending' END"
+            connection.execute(
+                f"UPDATE jobs SET status = {status_sql}, worker = NULL, lease_until = NULL, error = ?, "
+                f"updated_at = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (error, now, job_id, name))
+
+    def is_drained(self):
+        """True, если не осталось ни свободных, ни арендованных заданий."""
+        counts = self.counts()
+        return not counts.get("pending") and not counts.get("leased")
+
+    def record_result(self, job_id, name, path, **fields):
+        """Сохраняет или дополняет сведения о файле, полученном по заданию."""
+        columns = ["job_id", "worker", "path", "recorded_at"] + list(fields)
+        values = [job_id, name, os.path.abspath(path), time.time()] + list(fields.values())
+        updates = ", ".join(f"{column} = COALESCE(excluded.{column}, {column})" for column in fields)
+        sql = (f"INSERT INTO results ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+               f"ON CONFLICT(job_id, path) DO UPDATE SET recorded_at = excluded.recorded_at"
+               + (f", {updates}" if updates else ""))
+        with self._transaction() as connection:
+            connection.execute(sql, values)
+
+
+class ResultSink:
+    """
+    Приёмник результатов одного задания с интерфейсом каталога
+    (postprocessor_hook и record_verification), который понимают
+    download_content и Verifier. Открывает своё соединение на каждую запись,
+    поэтому безопасен для вызова из потоков yt-dlp и проверки.
+    """
+
+    def __init__(self, queue_path, job_id, worker):
+        self.queue_path = queue_path
+        self.job_id = job_id
+        self.worker = worker
+
+    def _record(self, path, **fields):
+        queue = JobQueue(self.queue_path)
+        try:
+            queue.record_result(self.job_id, self.worker, path, **fields)
+        finally:
+            queue.close()
+
+    def postprocessor_hook(self, url):
+        def _hook(d):
+            if d.get("postprocessor") == "MoveFiles" and d.get("status") == "finished":
+                info = d.get("info_dict") or {}
+                path = info.get("filepath")
+                if path:
+                    size = os.path.getsize(path) if os.path.exists(path) else None
+                    self._record(path, url=url, video_id=info.get("id"), title=info.get("title"),
+                                 duration=info.get("duration"), size=size)
+        return _hook
+
+    def record_verification(self, path, url, size, sha256, duration, status):
+        self._record(path, url=url, size=size, sha256=sha256, duration=duration, status=status)
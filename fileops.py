@@ -0,0 +1,191 @@
+"""
+Перемещение файлов для организаторов (update.py, del meta.py).
+
+В пределах одного тома файл просто переименовывается. Между томами содержимое
+копируется на стороне ядра (os.copy_file_range, затем os.sendfile; если ни один
+не поддерживается — блоками через os.read/os.write), время изменения переносится
+через дескриптор копии, а исходник удаляется только после сверки размера.
+Копирования между томами выполняются в ограниченном пуле потоков.
+"""
+import errno
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Константы
+MOVE_WORKERS = 4  # Потоков копирования между томами
+MAX_PENDING_MOVES = 64  # Копирований в работе и в очереди, после чего move() ждёт
+KERNEL_CHUNK_SIZE = 64 * 1024 * 1024  # Байт за один вызов copy_file_range/sendfile
+COPY_BUFFER_SIZE = 1024 * 1024  # Размер блока при копировании без поддержки ядра
+
+# Ошибки, при которых способ копирования не поддерживается и надо пробовать следующий
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF,
+                       errno.ENOTSUP, errno.ENOTSOCK}
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+_device_cache = {}  # Папка назначения -> st_dev
+_device_lock = threading.Lock()
+
+
+def device_of(directory):
+    """Возвращает устройство (том) папки, запоминая результат."""
+    directory = os.fspath(directory)
+    with _device_lock:
+        device = _device_cache.get(directory)
+    if device is None:
+        device = os.stat(directory).st_dev
+        with _device_lock:
+            _device_cache[directory] = device
+    return device
+
+
+def same_device(source, target, source_device=None):
+    """True, если source и папка target лежат на одном томе."""
+    if source_device is None:
+        source_device = os.stat(source).st_dev
+    return source_device == device_of(os.path.dirname(os.fspath(target)))
+
+
+def _kernel_copy(source_fd, target_fd, size):
+    """Копирует size байт средствами ядра. Возвращает число байт или None, если ядро не умеет."""
+    for name in ("copy_file_range", "sendfile"):
+        if not hasattr(os, name):
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                count = min(KERNEL_CHUNK_SIZE, size - offset)
+                if name == "copy_file_range":
+                    sent = os.copy_file_range(source_fd, target_fd, count, offset, offset)
+                else:
+                    sent = os.sendfile(target_fd, source_fd, offset, count)
+                if sent == 0:
+                    break  # Файл укоротился во время копирования
+                offset += sent
+            return offset
+        except OSError as e:
+            if offset or e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+    return None
+
+
+def _buffered_copy(source_fd, target_fd):
+    copied = 0
+    while True:
+        chunk = os.read(source_fd, COPY_BUFFER_SIZE)
+        if not chunk:
+            return copied
+        view = memoryview(chunk)
+        while view:
+            written = os.write(target_fd, view)
+            view = view[written:]
+            copied += written
+
+
+def copy_file(source, target, preserve_times=True):
+    """
+    Копирует source в новый файл target (существующий не перезаписывается).
+    При preserve_times время доступа и изменения переносятся с исходника.
+    Если размер копии не совпал с исходником, копия удаляется и выбрасывается OSError.
+    """
+    source_fd = os.open(source, os.O_RDONLY | _O_BINARY)
+    try:
+        stat = os.fstat(source_fd)
+        target_fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL | _O_BINARY, stat.st_mode & 0o777)
+        try:
+            try:
+                if _kernel_copy(source_fd, target_fd, stat.st_size) is None:
+                    _buffered_copy(source_fd, target_fd)
+                if preserve_times and os.utime in os.supports_fd:
+                    os.utime(target_fd, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+                written = os.fstat(target_fd).st_size
+            finally:
+                os.close(target_fd)
+            if preserve_times and os.utime not in os.supports_fd:
+                os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            if written != stat.st_size:
+                raise OSError(errno.EIO, f"размер копии {written} байт вместо {stat.st_size}", os.fspath(target))
+        except BaseException:
+            # Недописанная или неверная копия не должна остаться в результате
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+            raise
+    finally:
+        os.close(source_fd)
+    return stat
+
+
+def move_file(source, target, preserve_times=True, source_device=None):
+    """
+    Перемещает source в target: переименованием, если это один том, иначе
+    копированием с проверкой размера и удалением исходника.
+    Возвращает 'rename' или 'copy'.
+    """
+    if same_device(source, target, source_device):
+        try:
+            os.rename(source, target)
+            return "rename"
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    copy_file(source, target, preserve_times)
+    os.remove(source)
+    return "copy"
+
+
+class MovePool:
+    """
+    Перемещение множества файлов. Переименования в пределах тома выполняются
+    сразу в вызывающем потоке (ошибка пробрасывается), копирования между томами —
+    в пуле потоков; move() ждёт, когда в работе уже max_pending копирований.
+    Ошибки копирований собираются и возвращаются из close().
+    """
+
+    def __init__(self, max_workers=MOVE_WORKERS, max_pending=MAX_PENDING_MOVES, preserve_times=True):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="move")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.preserve_times = preserve_times
+        self.lock = threading.Lock()
+        self.renamed_count = 0
+        self.copied_count = 0
+        self.errors = []
+
+    def move(self, source, target, source_device=None):
+        if same_device(source, target, source_device):
+            try:
+                os.rename(source, target)
+                self.renamed_count += 1
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self._copy, source, target)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+
+    def _copy(self, source, target):
+        try:
+            copy_file(source, target, self.preserve_times)
+            os.remove(source)
+            with self.lock:
+                self.copied_count += 1
+        except OSError as e:
+            with self.lock:
+                self.errors.append((source, e))
+
+    def close(self):
+        """Дожидается всех копирований и возвращает список (исходник, ошибка)."""
+        self.executor.shutdown(wait=True)
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,210 @@
+"""
+Журнал перемещений организаторов (update.py, del meta.py) и отмена запуска.
+
+Перед каждым переименованием в журнал дописывается строка JSON с исходным путём,
+новым путём и исходным временем изменения. Строка сразу уходит в ОС (переживает
+аварийное завершение процесса), а fsync выполняется пакетно — раз в
+JOURNAL_SYNC_EVERY записей или JOURNAL_SYNC_INTERVAL секунд и при закрытии.
+
+Отмена читает журнал и возвращает файлы на исходные места пакетно, в пуле потоков.
+
+Использование:
+    python journal.py list F:\\м
+    python journal.py undo F:\\м                 (последний запуск)
+    python journal.py undo F:\\м\\.journal\\<файл>.jsonl
+"""
+import itertools
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Константы
+JOURNAL_DIRNAME = ".journal"  # Папка журналов внутри результирующей папки
+JOURNAL_SYNC_EVERY = 256  # fsync после стольких записей
+JOURNAL_SYNC_INTERVAL = 1.0  # ...или после стольких секунд с прошлого fsync
+UNDO_WORKERS = 8  # Потоков при отмене
+
+
+class MoveJournal:
+    """
+    Потокобезопасный журнал одного запуска организатора.
+
+    kind записи: 'move' — файл переименован (исходник исчез), 'copy' — создана
+    копия, после чего исходник удалён (FileOrganizer), 'link' — дубликат разложен
+    жёсткой ссылкой на оригинал, после чего исходник удалён (mtime — время
+    самого дубликата; при отмене он возвращается отдельной копией).
+    """
+
+    def __init__(self, result_directory, tool):
+        directory = os.path.join(result_directory, JOURNAL_DIRNAME)
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND | getattr(os, "O_BINARY", 0)
+        # Имя с точностью до секунды может совпасть у двух запусков (в том числе с разных машин
+        # на общем томе): O_EXCL не даёт дописать в чужой журнал, номер подбирается заново.
+        # Номер стоит перед pid, чтобы журналы одной секунды сортировались по порядку создания
+        for sequence in itertools.count():
+            self.path = os.path.join(directory, f"{stamp}-{sequence:03d}-{os.getpid()}-{tool}.jsonl")
+            try:
+                self.fd = os.open(self.path, flags, 0o644)
+                break
+            except FileExistsError:
+                continue
+        self.lock = threading.Lock()
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self._write({"op": "begin", "tool": tool, "time": time.time()})
+
+    def _write(self, entry):
+        os.write(self.fd, (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def record(self, source, target, mtime, kind="move"):
+        """Записывает намерение переместить source в target. Вызывать ДО перемещения."""
+        with self.lock:
+            self._write({"op": kind, "src": str(source), "dst": str(target), "mtime": mtime})
+            self.unsynced += 1
+            if (self.unsynced >= JOURNAL_SYNC_EVERY
+                    or time.monotonic() - self.last_sync >= JOURNAL_SYNC_INTERVAL):
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.fd)
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.fd is None:
+                return
+            self._write({"op": "end", "time": time.time()})
+            self._sync()
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def list_journals(result_directory):
+    """Возвращает пути журналов результирующей папки от старых к новым."""
+    directory = os.path.join(result_directory, JOURNAL_DIRNAME)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".jsonl"))
+
+
+def read_journal(path):
+    """Читает журнал; оборванная последняя строка (аварийное завершение) пропускается."""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+
+def _undo_entry(entry):
+    """Отменяет одно перемещение. Возвращает 'restored', 'removed_copy' или 'skipped'."""
+    source, target = entry["src"], entry["dst"]
+    source_exists = os.path.lexists(source)
+    target_exists = os.path.lexists(target)
+    if not target_exists:
+        return "skipped"  # Перемещение не состоялось или уже отменено
+    if source_exists:
+        if entry["op"] in ("copy", "link"):
+            os.remove(target)  # Копия или ссылка создана, а исходник не успели удалить
+            return "removed_copy"
+        return "skipped"  # Исходное имя снова занято: не перезаписываем
+
+    os.makedirs(os.path.dirname(source), exist_ok=True)
+    if entry["op"] == "link" and os.stat(target).st_nlink > 1:
+        # Возвращаем самостоятельный файл, а не ещё одно имя оригинала:
+        # иначе правка или очистка одного затронет другой, а mtime у них общий
+        temporary = source + ".undo.tmp"
+        try:
+            shutil.copyfile(target, temporary)
+            os.replace(temporary, source)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        os.remove(target)
+    else:
+        try:
+            os.rename(target, source)
+        except OSError:
+            shutil.move(target, source)  # Другой том
+    if entry.get("mtime") is not None:
+        # Метки копии или перемещённого файла могли быть затёрты: возвращаем исходное время изменения
+        os.utime(source, (entry["mtime"], entry["mtime"]))
+    return "restored"
+
+
+def undo_journal(path, max_workers=UNDO_WORKERS):
+    """
+    Отменяет весь запуск по журналу: файлы возвращаются на исходные места
+    под исходными именами. Безопасно запускать повторно.
+    """
+    journal = read_journal(path)
+    entries = [entry for entry in journal if entry.get("op") in ("move", "copy", "link")]
+    if any(entry.get("op") == "undo" for entry in journal):
+        print(f"Внимание: запуск {path} уже отменялся, повторяем для оставшихся файлов.")
+    print(f"Отмена {len(entries)} перемещений из журнала {path}")
+
+    counts = {"restored": 0, "removed_copy": 0, "skipped": 0, "errors": 0}
+
+    def undo(entry):
+        try:
+            return _undo_entry(entry)
+        except OSError as e:
+            print(f"Ошибка при возврате {entry['dst']} -> {entry['src']}: {e}")
+            return "errors"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for outcome in executor.map(undo, reversed(entries)):
+            counts[outcome] += 1
+
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps({"op": "undo", "time": time.time(), "counts": counts}) + "\n")
+    print(f"Возвращено: {counts['restored']}, удалено лишних копий: {counts['removed_copy']}, "
+          f"пропущено: {counts['skipped']}, ошибок: {counts['errors']}")
+    return counts
+
+
+def main(argv):
+    if len(argv) != 3 or argv[1] not in ("list", "undo"):
+        print(__doc__)
+        return
+    target = argv[2]
+    if not os.path.exists(target):
+        print(f"Путь '{target}' не существует.")
+        return
+    if argv[1] == "list":
+        for path in list_journals(target):
+            entries = read_journal(path)
+            moves = sum(1 for entry in entries if entry.get("op") in ("move", "copy", "link"))
+            finished = any(entry.get("op") == "end" for entry in entries)
+            undone = any(entry.get("op") == "undo" for entry in entries)
+            state = "отменён" if undone else ("завершён" if finished else "прерван")
+            print(f"{path}: {moves} перемещений, {state}")
+        return
+
+    if os.path.isdir(target):
+        journals = list_journals(target)
+        if not journals:
+            print(f"В папке '{target}' нет журналов.")
+            return
+        target = journals[-1]
+    undo_journal(target)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,309 @@
+"""
+Удаление метаданных из аудио и видео без перекодирования (del meta.py, Downloader.py).
+
+MP4/M4A/MOV: блоки udta и meta внутри moov и trak переименовываются в free
+и заполняются нулями. Размеры блоков не меняются, поэтому таблицы смещений
+дорожек (stco/co64) остаются верными.
+Matroska/WebM: элементы Tags и Title/DateUTC из Info заменяются элементами
+Void той же длины, MuxingApp/WritingApp (обязательные) заполняются нулями.
+MP3: теги ID3v2 в начале и ID3v1 в конце отрезаются при потоковом копировании.
+
+Для MP4 и Matroska правка идёт на месте, с чтением только заголовков:
+кластеры и mdat пропускаются переходом по смещению, так что многогигабайтные
+видео очищаются со скоростью копирования файла.
+"""
+import os
+import shutil
+import struct
+
+# Константы
+MEDIA_SUFFIXES = {'.mp4', '.m4a', '.m4v', '.mov', '.mkv', '.mka', '.webm', '.mp3'}  # Форматы, очищаемые от метаданных
+COPY_BUFFER_SIZE = 1024 * 1024  # Размер блока при потоковом копировании
+
+MP4_CONTAINERS = {b'moov', b'trak'}  # Блоки, внутри которых ищутся метаданные
+MP4_METADATA_BOXES = {b'udta', b'meta'}
+
+EBML_VOID = 0xEC
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_TAGS = 0x1254C367
+EBML_VOID_IN_INFO = {0x7BA9, 0x4461}  # Title, DateUTC
+EBML_BLANK_IN_INFO = {0x4D80, 0x5741}  # MuxingApp, WritingApp — обязательны, поэтому только обнуляются
+
+ID3V1_SIZE = 128
+
+
+def _read_exact(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("файл обрывается посреди структуры")
+    return data
+
+
+def _zero(file, offset, size):
+    file.seek(offset)
+    while size:
+        block = min(size, COPY_BUFFER_SIZE)
+        file.write(bytes(block))
+        size -= block
+
+
+def _mp4_boxes(file, start, end):
+    """Генерирует (смещение, длина заголовка, полный размер, тип) блоков MP4 в диапазоне [start, end)."""
+    offset = start
+    while offset + 8 <= end:
+        file.seek(offset)
+        size, kind = struct.unpack('>I4s', _read_exact(file, 8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', _read_exact(file, 8))[0]
+            header = 16
+        elif size == 0:
+            size = end - offset  # Блок до конца файла
+        if size < header or offset + size > end:
+            raise ValueError(f"неверный размер блока {kind!r}")
+        yield offset, header, size, kind
+        offset += size
+
+
+def _scrub_mp4(file, start, end, probe):
+    removed = False
+    for offset, header, size, kind in list(_mp4_boxes(file, start, end)):
+        if kind in MP4_METADATA_BOXES:
+            if probe:
+                return True
+            file.seek(offset + 4)  # Тип стоит сразу за 32-битным размером, и при largesize тоже
+            file.write(b'free')
+            _zero(file, offset + header, size - header)
+            removed = True
+        elif kind in MP4_CONTAINERS:
+            removed = _scrub_mp4(file, offset + header, offset + size, probe) or removed
+            if removed and probe:
+                return True
+    return removed
+
+
+def scrub_mp4(file, probe=False):
+    """
+    Очищает открытый на чтение и запись файл MP4/MOV на месте. Возвращает True, если что-то удалено.
+    При probe файл только читается: True, если метаданные есть.
+    """
+    size = os.fstat(file.fileno()).st_size
+    file.seek(4)
+    if _read_exact(file, 4) not in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):
+        raise ValueError("нет заголовка MP4")
+    return _scrub_mp4(file, 0, size, probe)
+
+
+def _read_vint(file, keep_marker):
+    """Читает целое переменной длины EBML. Возвращает (значение, длина в байтах)."""
+    first = _read_exact(file, 1)[0]
+    width = 1
+    while width <= 8 and not first & (0x80 >> (width - 1)):
+        width += 1
+    if width > 8:
+        raise ValueError("неверное число EBML")
+    value = first if keep_marker else first & (0xFF >> width)
+    for byte in _read_exact(file, width - 1):
+        value = (value << 8) | byte
+    return value, width
+
+
+def _ebml_elements(file, start, end):
+    """Генерирует (смещение, длина заголовка, размер данных или None, ID) элементов EBML в [start, end)."""
+    offset = start
+    while offset < end:
+        file.seek(offset)
+        element, id_width = _read_vint(file, keep_marker=True)
+        size, size_width = _read_vint(file, keep_marker=False)
+        header = id_width + size_width
+        if size == (1 << (7 * size_width)) - 1:
+            size = None  # Неизвестный размер (потоковая запись)
+        elif offset + header + size > end:
+            raise ValueError(f"элемент EBML 0x{element:X} выходит за пределы родителя")
+        yield offset, header, size, element
+        if size is None:
+            return
+        offset += header + size
+
+
+def _void(file, offset, header, size):
+    """Заменяет элемент EBML элементом Void той же полной длины и обнуляет данные."""
+    total = header + size
+    width = min(8, header - 1)
+    file.seek(offset)
+    file.write(bytes((EBML_VOID,)) + ((1 << (7 * width)) | (total - 1 - width)).to_bytes(width, 'big'))
+    _zero(file, offset + 1 + width, total - 1 - width)
+
+
+def scrub_matroska(file, probe=False):
+    """
+    Очищает открытый на чтение и запись файл Matroska/WebM на месте. Возвращает True, если что-то удалено.
+    При probe файл только читается: True, если метаданные есть.
+    """
+    size = os.fstat(file.fileno()).st_size
+    file.seek(0)
+    if _read_exact(file, 4) != b'\x1a\x45\xdf\xa3':
+        raise ValueError("нет заголовка EBML")
+    removed = False
+    for offset, header, length, element in list(_ebml_elements(file, 0, size)):
+        if element != EBML_SEGMENT:
+            continue
+        segment_end = size if length is None else offset + header + length
+        for child, child_header, child_length, child_id in _ebml_elements(file, offset + header, segment_end):
+            if child_length is None:
+                break  # Кластер неизвестного размера: дальше не пройти без разбора блоков
+            if child_id == EBML_TAGS:
+                if probe:
+                    return True
+                _void(file, child, child_header, child_length)
+                removed = True
+            elif child_id == EBML_INFO:
+                start = child + child_header
+                for item, item_header, item_length, item_id in list(
+                        _ebml_elements(file, start, start + child_length)):
+                    if item_length is None:
+                        break
+                    if item_id in EBML_VOID_IN_INFO:
+                        if probe:
+                            return True
+                        _void(file, item, item_header, item_length)
+                        removed = True
+                    elif item_id in EBML_BLANK_IN_INFO:
+                        file.seek(item + item_header)
+                        if any(_read_exact(file, item_length)):  # Уже обнулённое поле не трогаем
+                            if probe:
+                                return True
+                            _zero(file, item + item_header, item_length)
+                            removed = True
+    return removed
+
+
+def _id3v2_size(header):
+    """Полный размер тега ID3v2 по его 10-байтовому заголовку или 0, если тега нет."""
+    if header[:3] != b'ID3' or len(header) < 10:
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        if byte & 0x80:
+            raise ValueError("неверный размер тега ID3v2")
+        size = (size << 7) | byte
+    return 10 + size + (10 if header[5] & 0x10 else 0)  # Флаг 0x10 — есть футер
+
+
+def strip_mp3(source_path, dest_path):
+    """
+    Копирует MP3 без тегов ID3v2 (в начале, в том числе повторных) и ID3v1 (в конце).
+    Аудиоданные переносятся блоками по COPY_BUFFER_SIZE. Возвращает True, если что-то удалено.
+    """
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        end = os.fstat(source.fileno()).st_size
+        start = 0
+        while True:
+            source.seek(start)
+            tag_size = _id3v2_size(source.read(10))
+            if not tag_size:
+                break
+            start += tag_size
+        if end - start >= ID3V1_SIZE:
+            source.seek(end - ID3V1_SIZE)
+            if source.read(3) == b'TAG':
+                end -= ID3V1_SIZE
+        if start > end:
+            raise ValueError("тег ID3v2 длиннее файла")
+        source.seek(start)
+        remaining = end - start
+        while remaining:
+            block = _read_exact(source, min(remaining, COPY_BUFFER_SIZE))
+            dest.write(block)
+            remaining -= len(block)
+    return start > 0 or end < os.path.getsize(source_path)
+
+
+def _mp3_has_tags(file):
+    if _id3v2_size(file.read(10)):
+        return True
+    size = os.fstat(file.fileno()).st_size
+    if size < ID3V1_SIZE:
+        return False
+    file.seek(size - ID3V1_SIZE)
+    return file.read(3) == b'TAG'
+
+
+# Расширение -> очистка на месте
+MEDIA_SCRUBBERS = {'.mp4': scrub_mp4, '.m4a': scrub_mp4, '.m4v': scrub_mp4, '.mov': scrub_mp4,
+                   '.mkv': scrub_matroska, '.mka': scrub_matroska, '.webm': scrub_matroska}
+
+
+def has_media_metadata(path):
+    """
+    Проверяет по заголовкам, есть ли в файле метаданные, которые удаляет strip_media.
+    Файл только читается; данные дорожек пропускаются переходом по смещению.
+    """
+    suffix = os.path.splitext(os.fspath(path))[1].lower()
+    with open(path, 'rb') as file:
+        if suffix == '.mp3':
+            return _mp3_has_tags(file)
+        scrubber = MEDIA_SCRUBBERS.get(suffix)
+        if scrubber is None:
+            raise ValueError(f"формат {suffix} не поддерживается")
+        return scrubber(file, probe=True)
+
+
+def strip_media(source_path, dest_path):
+    """
+    Создаёт копию аудио или видео без метаданных. Исходный файл не изменяется.
+    Возвращает True, если метаданные были удалены.
+
+    :raises ValueError: Формат не поддерживается или файл не удалось разобрать.
+    """
+    suffix = os.path.splitext(os.fspath(source_path))[1].lower()
+    if suffix == '.mp3':
+        return strip_mp3(source_path, dest_path)
+    scrubber = MEDIA_SCRUBBERS.get(suffix)
+    if scrubber is None:
+        raise ValueError(f"формат {suffix} не поддерживается")
+    shutil.copyfile(source_path, dest_path)
+    with open(dest_path, 'r+b') as file:
+        return scrubber(file)
+
+
+def strip_media_in_place(path):
+    """
+    Удаляет метаданные из файла на месте, сохраняя время изменения.
+    MP4 и Matroska правятся без копирования, MP3 переписывается во временный файл рядом.
+    Возвращает True, если метаданные были удалены.
+    """
+    path = os.fspath(path)
+    stat = os.stat(path)
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix == '.mp3':
+        temporary = path + '.strip.tmp'
+        try:
+            removed = strip_mp3(path, temporary)
+            if removed:
+                os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+    else:
+        scrubber = MEDIA_SCRUBBERS.get(suffix)
+        if scrubber is None:
+            raise ValueError(f"формат {suffix} не поддерживается")
+        with open(path, 'r+b') as file:
+            removed = scrubber(file)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return removed
+
+
+def postprocessor_hook(output=print):
+    """Хук postprocessor_hooks yt-dlp: очищает готовый файл от метаданных на месте."""
+    def _hook(d):
+        if d.get("postprocessor") == "MoveFiles" and d.get("status") == "finished":
+            path = (d.get("info_dict") or {}).get("filepath")
+            if path and os.path.splitext(path)[1].lower() in MEDIA_SUFFIXES:
+                try:
+                    strip_media_in_place(path)
+                except (OSError, ValueError) as e:
+                    output(f"Не удалось очистить метаданные {path}: {e}")
+    return _hook
@@ -0,0 +1,883 @@
+"""
+Создание чистых копий файлов без метаданных (изображения, PDF).
+
+Вынесено из del meta.py в отдельный модуль, чтобы функцию можно было
+выполнять в пуле процессов: перекодирование Pillow и перезапись PDF
+на PyPDF2 упираются в процессор и GIL.
+
+JPEG, PNG и WebP очищаются без декодирования: сегменты JPEG, чанки PNG и
+чанки RIFF у WebP перебираются по заголовкам, метаданные отбрасываются,
+а сжатые данные изображения копируются как есть. У TIFF теги метаданных
+вычёркиваются из IFD прямо в копии файла, BMP метаданных не содержит и
+копируется. Если файл не удаётся разобрать, используется перекодирование
+через Pillow.
+
+В PDF словарь /Info и поток XMP затираются пробелами прямо в копии файла:
+длины и смещения объектов не меняются, поэтому таблица xref остаётся верной,
+а остальной документ не разбирается. PyPDF2 — запасной путь.
+
+Аудио и видео очищаются модулем mediastrip (в del meta.py — на месте,
+после перемещения, без чистой копии).
+
+needs_stripping проверяет по одним заголовкам, есть ли в файле что удалять,
+чтобы уже чистые файлы перемещались без создания копии.
+"""
+import mmap
+import os
+import re
+import shutil
+import struct
+import zlib
+from pathlib import Path
+
+from PIL import Image
+import PyPDF2
+
+from mediastrip import MEDIA_SUFFIXES, has_media_metadata, strip_media
+
+# Константы
+CLEAN_COPY_SUFFIXES = {'.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.webp', '.pdf'}  # Форматы, очищаемые через чистую копию
+KEEP_ICC_PROFILE = True  # Оставлять цветовой профиль (без него меняются цвета)
+KEEP_ORIENTATION = True  # Оставлять ориентацию снимка (без неё фото с телефона может повернуться)
+COPY_BUFFER_SIZE = 1024 * 1024  # Размер блока при потоковом копировании данных изображения
+
+# Маркеры JPEG
+JPEG_SOI = 0xD8
+JPEG_EOI = 0xD9
+JPEG_SOS = 0xDA
+JPEG_APP1 = 0xE1  # EXIF, XMP
+JPEG_APP2 = 0xE2  # ICC-профиль (и FlashPix/MPF)
+JPEG_APP13 = 0xED  # IPTC, Photoshop
+JPEG_COM = 0xFE  # Комментарий
+JPEG_STANDALONE = {0x01} | set(range(0xD0, 0xD8))  # Маркеры без длины
+EXIF_ORIENTATION_TAG = 0x0112
+MAX_EXIF_SIZE = 0x10000  # Больший блок EXIF не разбирается в поисках ориентации, а просто отбрасывается
+
+# Чанки контейнеров
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_METADATA_CHUNKS = {b'tEXt', b'iTXt', b'zTXt', b'eXIf', b'tIME'}
+WEBP_METADATA_CHUNKS = {b'EXIF', b'XMP '}
+WEBP_FLAG_ICC = 0x20  # Флаги в первом байте чанка VP8X
+WEBP_FLAG_EXIF = 0x08
+WEBP_FLAG_XMP = 0x04
+
+# Теги TIFF с метаданными: описание, камера, программа, дата, автор, XMP, IPTC, Photoshop, EXIF, GPS
+TIFF_METADATA_TAGS = {270, 271, 272, 305, 306, 315, 316, 700, 33432, 33723, 34377, 34665, 34853}
+TIFF_ICC_TAG = 34675
+TIFF_SUB_IFD_TAGS = {34665, 34853, 40965}  # Указатели на вложенные IFD (EXIF, GPS, Interoperability)
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+
+# PDF
+PDF_TAIL_SIZE = 4096  # Байт с конца файла, в которых ищется startxref
+PDF_SHORT_XMP = (b'<x:xmpmeta xmlns:x="adobe:ns:meta/">'
+                 b'<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"/></x:xmpmeta>')
+PDF_EMPTY_XMP = (b'<?xpacket begin="\xef\xbb\xbf" id="W5M0MpCehiHzreSzNTczkc9d"?>' + PDF_SHORT_XMP,
+                 b'<?xpacket end="w"?>')  # Пустой пакет XMP; PDF_SHORT_XMP — если пакет не помещается
+_PDF_REF = re.compile(rb'(\d+)\s+(\d+)\s+R')
+_PDF_DICT_ENTRY = {key: re.compile(rb'/' + key + rb'\s+(\d+)\s+(\d+)\s+R')
+                   for key in (b'Info', b'Root', b'Metadata')}
+_PDF_PREV = re.compile(rb'/Prev\s+(\d+)')
+_PDF_LENGTH = re.compile(rb'/Length\s+(\d+)(?!\d)(?!\s+\d+\s+R)')
+_PDF_FILTER = re.compile(rb'/(?:Filter|DecodeParms)\s*(?:/[^\s/<>\[\]()]+|\[[^\]]*\]|null)')
+_PDF_DECODE_PARMS_DICT = re.compile(rb'/DecodeParms\s*<<')
+
+
+def _read_exact(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("файл обрывается посреди структуры")
+    return data
+
+
+def _exif_orientation(tiff):
+    """Возвращает значение тега Orientation из IFD0 блока EXIF (данные TIFF) или None."""
+    if tiff[:2] == b'II':
+        order = '<'
+    elif tiff[:2] == b'MM':
+        order = '>'
+    else:
+        return None
+    try:
+        offset = struct.unpack_from(order + 'I', tiff, 4)[0]
+        count = struct.unpack_from(order + 'H', tiff, offset)[0]
+        for index in range(count):
+            tag, kind, _ = struct.unpack_from(order + 'HHI', tiff, offset + 2 + 12 * index)
+            if tag == EXIF_ORIENTATION_TAG and kind == 3:
+                return struct.unpack_from(order + 'H', tiff, offset + 2 + 12 * index + 8)[0]
+    except struct.error:
+        return None
+    return None
+
+
+def _orientation_tiff(orientation):
+    """Минимальный блок EXIF (данные TIFF) с одним тегом Orientation."""
+    return (b'MM\x00\x2a' + struct.pack('>I', 8) + struct.pack('>H', 1)
+            + struct.pack('>HHIHH', EXIF_ORIENTATION_TAG, 3, 1, orientation, 0) + struct.pack('>I', 0))
+
+
+def _orientation_segment(orientation):
+    """Минимальный сегмент APP1 с EXIF, содержащим только Orientation."""
+    payload = b'Exif\x00\x00' + _orientation_tiff(orientation)
+    return struct.pack('>BBH', 0xFF, JPEG_APP1, len(payload) + 2) + payload
+
+
+def _kept_orientation(tiff):
+    """Ориентация, которую нужно перенести в очищенный файл, или None (нет или нормальная)."""
+    if tiff.startswith(b'Exif\x00\x00'):
+        tiff = tiff[6:]
+    orientation = _exif_orientation(tiff)
+    return orientation if orientation and orientation != 1 else None
+
+
+def _copy_span(source, dest, size, crc=None):
+    """
+    Переносит size байт из source в dest (dest=None — пропустить) блоками по COPY_BUFFER_SIZE.
+    Если передан crc, возвращает CRC-32, продолженный по прочитанным байтам.
+    """
+    while size:
+        block = _read_exact(source, min(size, COPY_BUFFER_SIZE))
+        if crc is not None:
+            crc = zlib.crc32(block, crc)
+        if dest is not None:
+            dest.write(block)
+        size -= len(block)
+    return crc
+
+
+def strip_jpeg(source_path, dest_path, keep_icc=KEEP_ICC_PROFILE, keep_orientation=KEEP_ORIENTATION):
+    """
+    Копирует JPEG без сегментов APP1 (EXIF, XMP), APP13 (IPTC) и COM, не декодируя изображение.
+    Сжатые данные после SOS копируются блоками как есть, поэтому картинка
+    остаётся побитово той же, а память не зависит от размера файла.
+    При keep_orientation из EXIF сохраняется только тег Orientation, при keep_icc — профиль ICC.
+
+    :return: True, если что-то было удалено.
+    :raises ValueError: Файл не является корректным JPEG.
+    """
+    removed = False
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        if _read_exact(source, 2) != b'\xff\xd8':
+            raise ValueError("нет маркера SOI")
+        dest.write(b'\xff\xd8')
+        while True:
+            if _read_exact(source, 1) != b'\xff':
+                raise ValueError("ожидался маркер")
+            marker = _read_exact(source, 1)[0]
+            while marker == 0xFF:  # Байты-заполнители перед маркером
+                marker = _read_exact(source, 1)[0]
+            if marker in JPEG_STANDALONE:
+                dest.write(bytes((0xFF, marker)))
+                continue
+            if marker == JPEG_EOI:
+                dest.write(bytes((0xFF, marker)))
+                break
+            if marker == JPEG_SOI:
+                raise ValueError("повторный маркер SOI")
+
+            length_bytes = _read_exact(source, 2)
+            length = struct.unpack('>H', length_bytes)[0]
+            if length < 2:
+                raise ValueError("неверная длина сегмента")
+            payload = _read_exact(source, length - 2)
+
+            if marker == JPEG_APP1:
+                # Блок EXIF с одной ориентацией, оставленный прошлой очисткой, удалением не считается
+                if not (keep_orientation and payload.startswith(b'Exif\x00\x00') and _is_kept_exif(payload)):
+                    removed = True
+                if keep_orientation and payload.startswith(b'Exif\x00\x00'):
+                    orientation = _kept_orientation(payload)
+                    if orientation:
+                        dest.write(_orientation_segment(orientation))
+                continue
+            if marker in (JPEG_APP13, JPEG_COM):
+                removed = True
+                continue
+            if marker == JPEG_APP2 and payload.startswith(b'ICC_PROFILE\x00') and not keep_icc:
+                removed = True
+                continue
+
+            dest.write(bytes((0xFF, marker)) + length_bytes + payload)
+            if marker == JPEG_SOS:
+                # Дальше — сжатые данные (и для прогрессивного JPEG следующие сканы): копируем как есть
+                shutil.copyfileobj(source, dest, COPY_BUFFER_SIZE)
+                break
+    return removed
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def strip_png(source_path, dest_path, keep_icc=KEEP_ICC_PROFILE, keep_orientation=KEEP_ORIENTATION):
+    """
+    Копирует PNG без чанков tEXt, iTXt, zTXt, eXIf и tIME, не декодируя изображение.
+    Чанки переносятся блоками по COPY_BUFFER_SIZE, CRC каждого чанка проверяется.
+    При keep_orientation вместо eXIf записывается минимальный eXIf с одной ориентацией,
+    без keep_icc отбрасывается и профиль iCCP.
+
+    :return: True, если что-то было удалено.
+    :raises ValueError: Файл не является корректным PNG (в том числе при неверной CRC).
+    """
+    removed = False
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        if _read_exact(source, 8) != PNG_SIGNATURE:
+            raise ValueError("нет сигнатуры PNG")
+        dest.write(PNG_SIGNATURE)
+        while True:
+            header = _read_exact(source, 8)
+            length, kind = struct.unpack('>I4s', header)
+            if length > 0x7FFFFFFF:
+                raise ValueError("неверная длина чанка")
+            drop = kind in PNG_METADATA_CHUNKS or (kind == b'iCCP' and not keep_icc)
+            orientation = None
+            if kind == b'eXIf' and keep_orientation and length <= MAX_EXIF_SIZE:
+                data = _read_exact(source, length)
+                crc = zlib.crc32(data, zlib.crc32(kind))
+                orientation = _kept_orientation(data)
+            else:
+                if not drop:
+                    dest.write(header)
+                crc = _copy_span(source, None if drop else dest, length, zlib.crc32(kind))
+            stored = _read_exact(source, 4)
+            if struct.unpack('>I', stored)[0] != crc:
+                raise ValueError(f"неверная CRC чанка {kind!r}")
+            if drop:
+                if not (orientation and _is_kept_exif(data)):
+                    removed = True
+                if orientation:
+                    dest.write(_png_chunk(b'eXIf', _orientation_tiff(orientation)))
+            else:
+                dest.write(stored)
+            if kind == b'IEND':
+                break
+    return removed
+
+
+def strip_webp(source_path, dest_path, keep_icc=KEEP_ICC_PROFILE, keep_orientation=KEEP_ORIENTATION):
+    """
+    Копирует WebP без чанков EXIF и XMP, не декодируя изображение.
+    Флаги чанка VP8X и размер RIFF исправляются под оставшиеся чанки,
+    данные переносятся блоками по COPY_BUFFER_SIZE.
+    При keep_orientation вместо EXIF записывается минимальный EXIF с одной ориентацией,
+    без keep_icc отбрасывается и профиль ICCP.
+
+    :return: True, если что-то было удалено.
+    :raises ValueError: Файл не является корректным WebP.
+    """
+    removed = False
+    cleared_flags = WEBP_FLAG_XMP
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        riff, riff_size, form = struct.unpack('<4sI4s', _read_exact(source, 12))
+        if riff != b'RIFF' or form != b'WEBP' or riff_size < 4:
+            raise ValueError("нет заголовка RIFF WEBP")
+        dest.write(b'RIFF\x00\x00\x00\x00WEBP')  # Размер дописывается в конце
+        written = 4
+        vp8x_flags = vp8x_flags_offset = None
+        remaining = riff_size - 4
+        while remaining >= 8:
+            header = _read_exact(source, 8)
+            kind, size = struct.unpack('<4sI', header)
+            padded = size + (size & 1)
+            if padded > remaining - 8:
+                raise ValueError(f"чанк {kind!r} выходит за пределы файла")
+            remaining -= 8 + padded
+
+            drop = kind in WEBP_METADATA_CHUNKS or (kind == b'ICCP' and not keep_icc)
+            if drop:
+                orientation = None
+                if kind == b'EXIF' and keep_orientation and size <= MAX_EXIF_SIZE:
+                    payload = _read_exact(source, padded)
+                    orientation = _kept_orientation(payload)
+                    if not (orientation and _is_kept_exif(payload[:size])):
+                        removed = True
+                else:
+                    _copy_span(source, None, padded)
+                    removed = True
+                if orientation:
+                    tiff = _orientation_tiff(orientation)
+                    dest.write(struct.pack('<4sI', b'EXIF', len(tiff)) + tiff)
+                    written += 8 + len(tiff)
+                elif kind == b'EXIF':
+                    cleared_flags |= WEBP_FLAG_EXIF
+                elif kind == b'ICCP':
+                    cleared_flags |= WEBP_FLAG_ICC
+                continue
+
+            dest.write(header)
+            if kind == b'VP8X':
+                payload = _read_exact(source, padded)
+                vp8x_flags, vp8x_flags_offset = payload[0], 8 + written + 8
+                dest.write(payload)
+            else:
+                _copy_span(source, dest, padded)
+            written += 8 + padded
+        if remaining:
+            raise ValueError("неполный чанк в конце файла")
+
+        if vp8x_flags_offset is not None:
+            dest.seek(vp8x_flags_offset)
+            dest.write(bytes((vp8x_flags & ~cleared_flags,)))
+        dest.seek(4)
+        dest.write(struct.pack('<I', written))
+    return removed
+
+
+def _zero_span(file, offset, size):
+    file.seek(offset)
+    while size:
+        block = min(size, COPY_BUFFER_SIZE)
+        file.write(bytes(block))
+        size -= block
+
+
+class _TiffEditor:
+    """Правка IFD в копии TIFF: чтение записей, затирание значений и вложенных IFD."""
+
+    def __init__(self, file):
+        self.file = file
+        self.size = os.fstat(file.fileno()).st_size
+        file.seek(0)
+        header = _read_exact(file, 8)
+        if header[:2] == b'II':
+            self.order = '<'
+        elif header[:2] == b'MM':
+            self.order = '>'
+        else:
+            raise ValueError("нет заголовка TIFF")
+        magic, self.first_ifd = struct.unpack(self.order + 'HI', header[2:])
+        if magic != 42:
+            raise ValueError("неподдерживаемый вариант TIFF (BigTIFF)")
+        self.visited = set()
+
+    def _check(self, offset, size):
+        if offset + size > self.size:
+            raise ValueError("структура TIFF выходит за пределы файла")
+
+    def read_ifd(self, offset):
+        """Возвращает (записи IFD как (тег, тип, количество, сырое значение), смещение следующего IFD)."""
+        if offset in self.visited:
+            raise ValueError("цикл в цепочке IFD")
+        self.visited.add(offset)
+        self._check(offset, 2)
+        self.file.seek(offset)
+        count = struct.unpack(self.order + 'H', _read_exact(self.file, 2))[0]
+        self._check(offset, 2 + 12 * count + 4)
+        entries = []
+        for _ in range(count):
+            tag, kind, number = struct.unpack(self.order + 'HHI', _read_exact(self.file, 8))
+            entries.append((tag, kind, number, _read_exact(self.file, 4)))
+        next_ifd = struct.unpack(self.order + 'I', _read_exact(self.file, 4))[0]
+        return entries, next_ifd
+
+    def erase_entry(self, entry):
+        """Затирает нулями значение записи, лежащее вне IFD, и вложенный IFD, если запись на него указывает."""
+        tag, kind, number, raw = entry
+        if kind not in TIFF_TYPE_SIZES:
+            raise ValueError(f"неизвестный тип {kind} у тега {tag}")
+        size = TIFF_TYPE_SIZES[kind] * number
+        if size > 4:
+            offset = struct.unpack(self.order + 'I', raw)[0]
+            self._check(offset, size)
+            _zero_span(self.file, offset, size)
+        if tag in TIFF_SUB_IFD_TAGS and number == 1 and kind in (4, 13):
+            self.erase_ifd(struct.unpack(self.order + 'I', raw)[0])
+
+    def erase_ifd(self, offset):
+        entries, _ = self.read_ifd(offset)
+        for entry in entries:
+            self.erase_entry(entry)
+        _zero_span(self.file, offset, 2 + 12 * len(entries) + 4)
+
+    def write_ifd(self, offset, entries, removed, next_ifd):
+        """Переписывает IFD на прежнем месте: оставшиеся записи, указатель на следующий IFD, нули."""
+        self.file.seek(offset)
+        self.file.write(struct.pack(self.order + 'H', len(entries)))
+        for tag, kind, number, raw in entries:
+            self.file.write(struct.pack(self.order + 'HHI', tag, kind, number) + raw)
+        self.file.write(struct.pack(self.order + 'I', next_ifd))
+        self.file.write(bytes(12 * removed))
+
+
+def strip_tiff(source_path, dest_path, keep_icc=KEEP_ICC_PROFILE):
+    """
+    Копирует TIFF и вычёркивает из всех его IFD (всех страниц) теги метаданных:
+    описание, камеру, программу, дату, автора, XMP, IPTC, Photoshop, EXIF и GPS.
+    Значения удалённых тегов и вложенные IFD затираются нулями, данные изображения
+    не трогаются и не декодируются. Без keep_icc удаляется и профиль ICC.
+
+    :return: True, если что-то было удалено.
+    :raises ValueError: Файл не является корректным TIFF (или это BigTIFF).
+    """
+    drop_tags = TIFF_METADATA_TAGS if keep_icc else TIFF_METADATA_TAGS | {TIFF_ICC_TAG}
+    shutil.copyfile(source_path, dest_path)
+    removed = False
+    with open(dest_path, 'r+b') as file:
+        editor = _TiffEditor(file)
+        offset = editor.first_ifd
+        while offset:
+            entries, next_ifd = editor.read_ifd(offset)
+            kept = [entry for entry in entries if entry[0] not in drop_tags]
+            if len(kept) != len(entries):
+                removed = True
+                for entry in entries:
+                    if entry[0] in drop_tags:
+                        editor.erase_entry(entry)
+                editor.write_ifd(offset, kept, len(entries) - len(kept), next_ifd)
+            offset = next_ifd
+    return removed
+
+
+def _pdf_dict_end(data, start):
+    """Возвращает позицию сразу за словарём PDF, начинающимся с << в позиции start."""
+    if data[start:start + 2] != b'<<':
+        raise ValueError("ожидался словарь PDF")
+    depth = 0
+    position = start
+    end = len(data)
+    while position < end:
+        char = data[position:position + 1]
+        if char == b'(':
+            # Строка: скобки внутри могут быть вложенными или экранированными
+            nesting = 0
+            while position < end:
+                char = data[position:position + 1]
+                if char == b'\\':
+                    position += 1
+                elif char == b'(':
+                    nesting += 1
+                elif char == b')':
+                    nesting -= 1
+                    if not nesting:
+                        break
+                position += 1
+        elif char == b'<' and data[position + 1:position + 2] != b'<':
+            # Шестнадцатеричная строка
+            position = data.find(b'>', position)
+            if position < 0:
+                break
+        elif data[position:position + 2] == b'<<':
+            depth += 1
+            position += 1
+        elif data[position:position + 2] == b'>>':
+            depth -= 1
+            position += 1
+            if not depth:
+                return position + 1
+        position += 1
+    raise ValueError("незакрытый словарь PDF")
+
+
+def _pdf_objects(data, number, generation):
+    """Позиции начала содержимого (сразу после 'obj') всех определений объекта во всех ревизиях файла."""
+    pattern = re.compile(rb'(?<![0-9])' + str(number).encode() + rb'\s+' + str(generation).encode() + rb'\s+obj\b')
+    positions = [match.end() for match in pattern.finditer(data)]
+    if not positions:
+        raise ValueError(f"объект {number} {generation} не найден (возможно, лежит в потоке объектов)")
+    return positions
+
+
+def _pdf_object_dict(data, position):
+    """Возвращает (начало, конец) словаря объекта, содержимое которого начинается в position."""
+    while data[position:position + 1].isspace():
+        position += 1
+    return position, _pdf_dict_end(data, position)
+
+
+def _pdf_trailers(data):
+    """Словари трейлеров (и потоков xref) всех ревизий по цепочке startxref / /Prev."""
+    tail_start = max(0, len(data) - PDF_TAIL_SIZE)
+    matches = list(re.finditer(rb'startxref\s+(\d+)', data[tail_start:]))
+    if not matches:
+        raise ValueError("не найден startxref")
+    offset = int(matches[-1].group(1))
+    trailers = []
+    visited = set()
+    while offset not in visited:
+        visited.add(offset)
+        if data[offset:offset + 4] == b'xref':
+            position = data.find(b'trailer', offset)
+            if position < 0:
+                raise ValueError("не найден trailer")
+            position += len(b'trailer')
+        else:
+            match = re.compile(rb'\s*\d+\s+\d+\s+obj').match(data, offset)
+            if not match:
+                raise ValueError("startxref указывает не на xref")
+            position = match.end()
+        start, end = _pdf_object_dict(data, position)
+        trailer = data[start:end]
+        trailers.append(trailer)
+        previous = _PDF_PREV.search(trailer)
+        if not previous:
+            break
+        offset = int(previous.group(1))
+    return trailers
+
+
+def _blank(data, start, end, replacement=b''):
+    data[start:end] = replacement + b' ' * (end - start - len(replacement))
+
+
+def _scrub_info(data, reference):
+    """
+    Очищает словарь /Info (во всех ревизиях) и строки, на которые он ссылается.
+    Возвращает True, если хотя бы один словарь был непустым.
+    """
+    removed = False
+    for position in _pdf_objects(data, *reference):
+        start, end = _pdf_object_dict(data, position)
+        values = [tuple(map(int, match.groups())) for match in _PDF_REF.finditer(data[start:end])]
+        if data[start + 2:end - 2].strip():
+            removed = True
+        _blank(data, start + 2, end - 2)
+        for value in values:
+            for value_position in _pdf_objects(data, *value):
+                value_end = data.find(b'endobj', value_position)
+                if value_end < 0 or data.find(b'stream', value_position, value_end) >= 0:
+                    continue  # Потоки не трогаем
+                _blank(data, value_position, value_end, b' null')
+    return removed
+
+
+def _pdf_stream_span(data, dictionary, end):
+    """(начало, конец) данных потока объекта, словарь которого dictionary заканчивается в end."""
+    match = re.compile(rb'\s*stream(\r\n|\n|\r)').match(data, end)
+    if not match:
+        raise ValueError("у объекта /Metadata нет потока")
+    stream_start = match.end()
+    length = _PDF_LENGTH.search(dictionary)
+    if length:
+        stream_end = stream_start + int(length.group(1))
+    else:
+        stream_end = data.find(b'endstream', stream_start)
+        if stream_end < 0:
+            raise ValueError("не найден endstream")
+    if data[stream_end:stream_end + 20].lstrip()[:9] != b'endstream':
+        raise ValueError("длина потока XMP не сходится")
+    return stream_start, stream_end
+
+
+def _scrub_xmp(data, reference):
+    """
+    Заменяет поток XMP пустым пакетом той же длины без сжатия.
+    Возвращает True, если хотя бы один поток не был пустым пакетом.
+    """
+    removed = False
+    for position in _pdf_objects(data, *reference):
+        start, end = _pdf_object_dict(data, position)
+        dictionary = data[start:end]
+        stream_start, stream_end = _pdf_stream_span(data, dictionary, end)
+        if (_PDF_FILTER.search(dictionary) or _PDF_DECODE_PARMS_DICT.search(dictionary)
+                or not _is_blank_xmp(data[stream_start:stream_end])):
+            removed = True
+        for match in _PDF_FILTER.finditer(dictionary):
+            _blank(data, start + match.start(), start + match.end())
+        match = _PDF_DECODE_PARMS_DICT.search(dictionary)
+        if match:
+            _blank(data, start + match.start(), _pdf_dict_end(data, start + match.end() - 2))
+        header, trailer = PDF_EMPTY_XMP
+        size = stream_end - stream_start
+        if size >= len(header) + len(trailer):
+            data[stream_start:stream_end] = header + b' ' * (size - len(header) - len(trailer)) + trailer
+        elif size >= len(PDF_SHORT_XMP):
+            _blank(data, stream_start, stream_end, PDF_SHORT_XMP)
+        else:
+            _blank(data, stream_start, stream_end)
+    return removed
+
+
+def _pdf_metadata_references(data):
+    """
+    Ссылки на словари /Info и потоки XMP каталога из трейлеров всех ревизий: (infos, metadata).
+
+    :raises ValueError: Файл зашифрован или структуру не удалось разобрать.
+    """
+    if data[:5] != b'%PDF-':
+        raise ValueError("нет заголовка PDF")
+    trailers = _pdf_trailers(data)
+    if any(b'/Encrypt' in trailer for trailer in trailers):
+        raise ValueError("зашифрованный PDF")
+
+    infos, roots = set(), set()
+    for trailer in trailers:
+        for key, found in ((b'Info', infos), (b'Root', roots)):
+            match = _PDF_DICT_ENTRY[key].search(trailer)
+            if match:
+                found.add(tuple(map(int, match.groups())))
+    metadata = set()
+    for root in roots:
+        for position in _pdf_objects(data, *root):
+            start, end = _pdf_object_dict(data, position)
+            match = _PDF_DICT_ENTRY[b'Metadata'].search(data[start:end])
+            if match:
+                metadata.add(tuple(map(int, match.groups())))
+    return infos, metadata
+
+
+def strip_pdf(source_path, dest_path):
+    """
+    Копирует PDF и затирает в копии словарь /Info и поток метаданных XMP каталога
+    во всех ревизиях файла. Правка идёт на месте через mmap с сохранением длин,
+    поэтому таблицы xref остаются верными, а страницы и остальные объекты
+    не читаются в память.
+
+    :return: True, если что-то было удалено.
+    :raises ValueError: Структуру не удалось разобрать (зашифрованный файл,
+        /Info внутри потока объектов и т.п.) — нужен запасной путь.
+    """
+    shutil.copyfile(source_path, dest_path)
+    with open(dest_path, 'r+b') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError("пустой файл")
+        with mmap.mmap(file.fileno(), 0) as data:
+            infos, metadata = _pdf_metadata_references(data)
+            removed = False
+            for reference in infos:
+                removed = _scrub_info(data, reference) or removed
+            for reference in metadata:
+                removed = _scrub_xmp(data, reference) or removed
+            data.flush()
+    return removed
+
+
+def _remove_partial(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _is_kept_exif(tiff):
+    """True, если блок EXIF — ровно тот минимальный блок с ориентацией, который оставляют очистители."""
+    if tiff.startswith(b'Exif\x00\x00'):
+        tiff = tiff[6:]
+    orientation = _kept_orientation(tiff)
+    return orientation is not None and tiff == _orientation_tiff(orientation)
+
+
+def _jpeg_needs_stripping(file, keep_icc, keep_orientation):
+    if _read_exact(file, 2) != b'\xff\xd8':
+        raise ValueError("нет маркера SOI")
+    while True:
+        if _read_exact(file, 1) != b'\xff':
+            raise ValueError("ожидался маркер")
+        marker = _read_exact(file, 1)[0]
+        while marker == 0xFF:
+            marker = _read_exact(file, 1)[0]
+        if marker in JPEG_STANDALONE:
+            continue
+        if marker in (JPEG_SOS, JPEG_EOI):
+            return False  # Дальше сжатые данные: сегменты метаданных стоят до них
+        length = struct.unpack('>H', _read_exact(file, 2))[0]
+        if length < 2:
+            raise ValueError("неверная длина сегмента")
+        if marker in (JPEG_APP13, JPEG_COM):
+            return True
+        if marker == JPEG_APP1:
+            if not keep_orientation or length - 2 > MAX_EXIF_SIZE:
+                return True
+            payload = _read_exact(file, length - 2)
+            if not (payload.startswith(b'Exif\x00\x00') and _is_kept_exif(payload)):
+                return True
+            continue
+        if marker == JPEG_APP2 and not keep_icc:
+            if _read_exact(file, min(12, length - 2)) == b'ICC_PROFILE\x00':
+                return True
+            file.seek(length - 2 - min(12, length - 2), os.SEEK_CUR)
+            continue
+        file.seek(length - 2, os.SEEK_CUR)
+
+
+def _png_needs_stripping(file, keep_icc, keep_orientation):
+    if _read_exact(file, 8) != PNG_SIGNATURE:
+        raise ValueError("нет сигнатуры PNG")
+    while True:
+        length, kind = struct.unpack('>I4s', _read_exact(file, 8))
+        if kind == b'eXIf' and keep_orientation and length <= MAX_EXIF_SIZE:
+            if not _is_kept_exif(_read_exact(file, length)):
+                return True
+            file.seek(4, os.SEEK_CUR)
+            continue
+        if kind in PNG_METADATA_CHUNKS or (kind == b'iCCP' and not keep_icc):
+            return True
+        if kind == b'IEND':
+            return False
+        file.seek(length + 4, os.SEEK_CUR)
+
+
+def _webp_needs_stripping(file, keep_icc, keep_orientation):
+    riff, riff_size, form = struct.unpack('<4sI4s', _read_exact(file, 12))
+    if riff != b'RIFF' or form != b'WEBP':
+        raise ValueError("нет заголовка RIFF WEBP")
+    remaining = riff_size - 4
+    while remaining >= 8:
+        kind, size = struct.unpack('<4sI', _read_exact(file, 8))
+        padded = size + (size & 1)
+        remaining -= 8 + padded
+        if kind == b'EXIF' and keep_orientation and size <= MAX_EXIF_SIZE:
+            if not _is_kept_exif(_read_exact(file, padded)[:size]):
+                return True
+            continue
+        if kind in WEBP_METADATA_CHUNKS or (kind == b'ICCP' and not keep_icc):
+            return True
+        file.seek(padded, os.SEEK_CUR)
+    return False
+
+
+def _tiff_needs_stripping(file, keep_icc):
+    drop_tags = TIFF_METADATA_TAGS if keep_icc else TIFF_METADATA_TAGS | {TIFF_ICC_TAG}
+    editor = _TiffEditor(file)
+    offset = editor.first_ifd
+    while offset:
+        entries, offset = editor.read_ifd(offset)
+        if any(entry[0] in drop_tags for entry in entries):
+            return True
+    return False
+
+
+def _is_blank_xmp(stream):
+    """True, если поток XMP — пустой пакет, который оставляет _scrub_xmp."""
+    header, trailer = PDF_EMPTY_XMP
+    if stream.startswith(header) and stream.endswith(trailer):
+        stream = stream[len(header):len(stream) - len(trailer)]
+    return stream.strip(b' ') in (b'', PDF_SHORT_XMP)
+
+
+def _pdf_needs_stripping(file, keep_icc, keep_orientation):
+    """
+    Ищет по трейлерам всех ревизий непустой словарь /Info или поток XMP каталога.
+    Файл отображается в память только на чтение; уже очищенный strip_pdf файл
+    (ссылки на месте, содержимое затёрто пробелами) считается чистым.
+    """
+    if os.fstat(file.fileno()).st_size == 0:
+        raise ValueError("пустой файл")
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        infos, metadata = _pdf_metadata_references(data)
+        for reference in infos:
+            for position in _pdf_objects(data, *reference):
+                start, end = _pdf_object_dict(data, position)
+                if data[start + 2:end - 2].strip():
+                    return True
+        for reference in metadata:
+            for position in _pdf_objects(data, *reference):
+                start, end = _pdf_object_dict(data, position)
+                dictionary = data[start:end]
+                if _PDF_FILTER.search(dictionary) or _PDF_DECODE_PARMS_DICT.search(dictionary):
+                    return True  # Сжатый XMP не проверить без распаковки
+                stream_start, stream_end = _pdf_stream_span(data, dictionary, end)
+                if not _is_blank_xmp(data[stream_start:stream_end]):
+                    return True
+    return False
+
+
+_PROBES = {'.jpg': _jpeg_needs_stripping, '.jpeg': _jpeg_needs_stripping,
+           '.png': _png_needs_stripping, '.webp': _webp_needs_stripping, '.pdf': _pdf_needs_stripping}
+
+
+def needs_stripping(path, keep_icc=KEEP_ICC_PROFILE, keep_orientation=KEEP_ORIENTATION):
+    """
+    Быстро проверяет, есть ли в файле метаданные, которые удаляет create_clean_copy.
+    Читаются только заголовки (сегменты до начала сжатых данных, заголовки чанков и IFD),
+    данные изображения и дорожек пропускаются.
+
+    BMP метаданных не содержит. В PDF по цепочке трейлеров проверяются словарь /Info
+    и поток XMP каталога.
+    Если файл не удаётся разобрать, возвращается True — пусть решает очиститель
+    со своим запасным путём.
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        if suffix in MEDIA_SUFFIXES:
+            return has_media_metadata(path)
+        if suffix == '.bmp':
+            return False
+        if suffix == '.tiff':
+            with open(path, 'rb') as file:
+                return _tiff_needs_stripping(file, keep_icc)
+        probe = _PROBES.get(suffix)
+        if probe is None:
+            return suffix in CLEAN_COPY_SUFFIXES
+        with open(path, 'rb') as file:
+            return probe(file, keep_icc, keep_orientation)
+    except (OSError, ValueError, struct.error):
+        return True
+
+
+# Расширение -> очистка без декодирования
+CONTAINER_STRIPPERS = {'.jpg': strip_jpeg, '.jpeg': strip_jpeg, '.png': strip_png, '.webp': strip_webp,
+                       '.tiff': strip_tiff, '.pdf': strip_pdf}
+CONTAINER_STRIPPERS.update(dict.fromkeys(MEDIA_SUFFIXES, strip_media))
+
+
+def create_clean_copy(source_path, dest_path):
+    """
+    Создаёт чистую копию файла без метаданных.
+    Исходный файл НЕ изменяется.
+    Возвращает True если метаданные были удалены.
+    """
+    source_path, dest_path = Path(source_path), Path(dest_path)
+    try:
+        suffix = source_path.suffix.lower()
+
+        # JPEG, PNG, WebP, TIFF, PDF, аудио и видео - очистка контейнера без перекодирования, при ошибке разбора - через Pillow
+        stripper = CONTAINER_STRIPPERS.get(suffix)
+        if stripper is not None:
+            try:
+                return bool(stripper(source_path, dest_path))
+            except (OSError, ValueError):
+                _remove_partial(dest_path)
+
+        # BMP не хранит метаданных - достаточно копии
+        if suffix == '.bmp':
+            shutil.copy2(source_path, dest_path)
+            return False
+
+        # Обработка изображений - создаём временную чистую копию
+        if suffix in ['.jpg', '.jpeg', '.png', '.tiff', '.bmp', '.webp']:
+            with Image.open(source_path) as img:
+                # Сохраняем БЕЗ метаданных в целевой файл
+                if suffix in ['.jpg', '.jpeg']:
+                    img.save(dest_path, 'JPEG', quality=95, optimize=False, exif=b'')
+                elif suffix == '.png':
+                    img.save(dest_path, 'PNG', optimize=False)
+                else:
+                    # Создаем новое изображение без EXIF из сырых пикселей (без объекта Python на каждый пиксель)
+                    clean_img = Image.frombytes(img.mode, img.size, img.tobytes())
+                    if img.mode == 'P':
+                        clean_img.putpalette(img.getpalette())
+                    clean_img.save(dest_path)
+            return True
+
+        # Обработка PDF, который не удалось очистить на месте - создаём чистую копию
+        elif suffix == '.pdf':
+            try:
+                with open(source_path, 'rb') as input_file:
+                    reader = PyPDF2.PdfReader(input_file)
+                    writer = PyPDF2.PdfWriter()
+
+                    # Копируем страницы без метаданных
+                    for page in reader.pages:
+                        writer.add_page(page)
+
+                    # Сохраняем чистый PDF
+                    with open(dest_path, 'wb') as output_file:
+                        writer.write(output_file)
+                return True
+            except:
+                # Если не получилось - просто копируем
+                shutil.copy2(source_path, dest_path)
+                return False
+
+        # Для остальных файлов - обычное копирование
+        else:
+            shutil.copy2(source_path, dest_path)
+            return False
+
+    except Exception as e:
+        # При ошибке пытаемся хотя бы скопировать файл
+        try:
+            if not dest_path.exists():
+                shutil.copy2(source_path, dest_path)
+        except:
+            pass
+        return False
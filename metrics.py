@@ -0,0 +1,246 @@
+"""
+Метрики конвейера загрузки.
+
+Для каждой ссылки и каждой фазы (probe, download, merge, convert) накапливаются
+время, объём данных и число выполнений, а также повторы и время ожидания в очереди.
+Результат выгружается в JSON Lines и в текстовый формат Prometheus.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Константы
+PHASES = ("probe", "download", "merge", "convert")
+RETRY_MARKER = "Retrying"  # Подстрока, по которой yt-dlp сообщает о повторе
+
+
+def get_domain(url):
+    """Извлекает домен из URL (для локальных файлов возвращает 'local')."""
+    parts = url.split('/')
+    if "://" in url and len(parts) > 2:
+        return parts[2]
+    return "local"
+
+
+class PipelineMetrics:
+    """Потокобезопасный сборщик метрик по ссылкам, фазам и доменам."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.links = {}  # url -> статистика ссылки
+
+    def _link(self, url):
+        link = self.links.get(url)
+        if link is None:
+            link = {
+                "domain": get_domain(url),
+                "queue_wait": 0.0,
+                "retries": 0,
+                "errors": 0,
+                "phases": {},
+            }
+            self.links[url] = link
+        return link
+
+    def add(self, url, phase, wall=0.0, size=0, count=1):
+        """Добавляет время (сек), байты и число выполнений к фазе ссылки."""
+        with self.lock:
+            stats = self._link(url)["phases"].setdefault(phase, {"wall": 0.0, "bytes": 0, "count": 0})
+            stats["wall"] += wall
+            stats["bytes"] += size
+            stats["count"] += count
+
+    @contextmanager
+    def phase(self, url, name):
+        """Замеряет время выполнения блока как фазу `name` для ссылки."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(url, name, wall=time.perf_counter() - start)
+
+    def add_queue_wait(self, url, seconds):
+        with self.lock:
+            self._link(url)["queue_wait"] += seconds
+
+    def add_retry(self, url):
+        with self.lock:
+            self._link(url)["retries"] += 1
+
+    def add_error(self, url):
+        with self.lock:
+            self._link(url)["errors"] += 1
+
+    def progress_hook(self, url):
+        """Хук progress_hooks yt-dlp: учитывает байты скачанных файлов."""
+        def _hook(d):
+            if d.get("status") == "finished":
+                size = d.get("total_bytes") or d.get("downloaded_bytes") or 0
+                self.add(url, "download", size=size, count=0)
+        return _hook
+
+    def postprocessor_hook(self, url):
+        """
+        Хук postprocessor_hooks yt-dlp: выделяет слияние дорожек в фазу merge.
+        Время слияния вычитается из фазы download, внутри которой оно выполняется.
+        """
+        started = {}
+
+        def _hook(d):
+            if d.get("postprocessor") != "Merger":
+                return
+            key = threading.get_ident()
+            if d.get("status") == "started":
+                started[key] = time.perf_counter()
+            elif d.get("status") == "finished" and key in started:
+                wall = time.perf_counter() - started.pop(key)
+                filepath = (d.get("info_dict") or {}).get("filepath")
+                size = os.path.getsize(filepath) if filepath and os.path.exists(filepath) else 0
+                self.add(url, "merge", wall=wall, size=size)
+                self.add(url, "download", wall=-wall, count=0)
+        return _hook
+
+    # --- Агрегация ---
+
+    def domain_totals(self):
+        """Возвращает агрегаты по доменам: {domain: {'links', 'queue_wait', 'retries', 'errors', 'phases'}}."""
+        with self.lock:
+            domains = {}
+            for link in self.links.values():
+                total = domains.setdefault(link["domain"], {
+                    "links": 0, "queue_wait": 0.0, "retries": 0, "errors": 0, "phases": {},
+                })
+                total["links"] += 1
+                total["queue_wait"] += link["queue_wait"]
+                total["retries"] += link["retries"]
+                total["errors"] += link["errors"]
+                for name, stats in link["phases"].items():
+                    phase = total["phases"].setdefault(name, {"wall": 0.0, "bytes": 0, "count": 0})
+                    for key in phase:
+                        phase[key] += stats[key]
+            return domains
+
+    @staticmethod
+    def _phase_record(stats):
+        wall = max(stats["wall"], 0.0)
+        return {
+            "wall_s": round(wall, 6),
+            "bytes": stats["bytes"],
+            "count": stats["count"],
+            "throughput_bps": round(stats["bytes"] / wall, 1) if wall > 0 else 0.0,
+        }
+
+    # --- Экспорт ---
+
+    def export_jsonl(self, path):
+        """Дописывает в файл JSON Lines записи по каждой ссылке/фазе и агрегаты по доменам."""
+        timestamp = time.time()
+        lines = []
+        with self.lock:
+            for url, link in self.links.items():
+                for name, stats in link["phases"].items():
+                    record = {"type": "phase", "ts": timestamp, "url": url, "domain": link["domain"],
+                              "phase": name, "retries": link["retries"], "errors": link["errors"],
+                              "queue_wait_s": round(link["queue_wait"], 6)}
+                    record.update(self._phase_record(stats))
+                    lines.append(record)
+        for domain, total in self.domain_totals().items():
+            for name, stats in total["phases"].items():
+                record = {"type": "domain", "ts": timestamp, "domain": domain, "phase": name,
+                          "links": total["links"], "retries": total["retries"], "errors": total["errors"],
+                          "queue_wait_s": round(total["queue_wait"], 6)}
+                record.update(self._phase_record(stats))
+                lines.append(record)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as file:
+            for record in lines:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def export_prometheus(self, path):
+        """Записывает агрегаты по доменам в текстовом формате Prometheus (атомарно)."""
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+        domains = self.domain_totals()
+        out = []
+        phase_metrics = (
+            ("downloader_phase_seconds_total", "counter", "Суммарное время фазы", "wall"),
+            ("downloader_phase_bytes_total", "counter", "Объём данных фазы", "bytes"),
+            ("downloader_phase_runs_total", "counter", "Число выполнений фазы", "count"),
+        )
+        for name, kind, help_text, key in phase_metrics:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for domain, total in sorted(domains.items()):
+                for phase, stats in sorted(total["phases"].items()):
+                    value = max(stats[key], 0)
+                    out.append(f'{name}{{domain="{label(domain)}",phase="{label(phase)}"}} {value}')
+
+        out.append("# HELP downloader_phase_throughput_bytes_per_second Средняя пропускная способность фазы")
+        out.append("# TYPE downloader_phase_throughput_bytes_per_second gauge")
+        for domain, total in sorted(domains.items()):
+            for phase, stats in sorted(total["phases"].items()):
+                value = self._phase_record(stats)["throughput_bps"]
+                out.append(f'downloader_phase_throughput_bytes_per_second'
+                           f'{{domain="{label(domain)}",phase="{label(phase)}"}} {value}')
+
+        domain_metrics = (
+            ("downloader_links_total", "counter", "Число обработанных ссылок", "links"),
+            ("downloader_retries_total", "counter", "Число повторов yt-dlp", "retries"),
+            ("downloader_errors_total", "counter", "Число неудачных загрузок", "errors"),
+            ("downloader_queue_wait_seconds_total", "counter", "Суммарное ожидание в очереди", "queue_wait"),
+        )
+        for name, kind, help_text, key in domain_metrics:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for domain, total in sorted(domains.items()):
+                out.append(f'{name}{{domain="{label(domain)}"}} {total[key]}')
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write("\n".join(out) + "\n")
+        os.replace(temp_path, path)
+
+    def export(self, jsonl_path, prometheus_path):
+        """Выгружает метрики в оба формата, ошибки выгрузки не прерывают работу."""
+        try:
+            self.export_jsonl(jsonl_path)
+            self.export_prometheus(prometheus_path)
+            print(f"Метрики сохранены: {jsonl_path}, {prometheus_path}")
+        except OSError as e:
+            print(f"Не удалось сохранить метрики: {e}")
+
+
+class YtdlpLogger:
+    """
+    Логгер для параметра 'logger' yt-dlp: считает повторы загрузки и
+    передаёт предупреждения и ошибки в общий вывод.
+    """
+
+    def __init__(self, metrics, url, output=print):
+        self.metrics = metrics
+        self.url = url
+        self.output = output
+
+    def debug(self, message):
+        if RETRY_MARKER in message:
+            self.metrics.add_retry(self.url)
+
+    def info(self, message):
+        self.debug(message)
+
+    def warning(self, message):
+        if RETRY_MARKER in message:
+            self.metrics.add_retry(self.url)
+        self.output(f"Предупреждение: {message}")
+
+    def error(self, message):
+        self.output(message)
@@ -0,0 +1,199 @@
+"""
+Профилирование фаз конвейера загрузки (режим --profile).
+
+Фоновый сэмплер собирает стеки всех потоков с пометкой текущей фазы (probe,
+download, convert, scan). До Python 3.12 каждая фаза дополнительно оборачивается
+в cProfile для того потока, где она выполняется. С 3.12 cProfile работает через
+sys.monitoring, где одновременно активен только один профилировщик, поэтому
+там используются только сэмплы: по ним строится сводка функций фазы.
+tracemalloc фиксирует выделения памяти; пик фазы — наибольший прирост памяти
+процесса от начала её запуска, замеряемый сэмплером (без общего reset_peak,
+который сбивал бы пики параллельных фаз).
+На выходе: отчёт (и до 3.12 .prof-файл) на каждую фазу и общий файл стеков в
+свёрнутом формате (stacks.folded), который понимают flamegraph.pl, speedscope и inferno.
+"""
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Константы
+SAMPLE_INTERVAL = 0.005  # Период сэмплирования стеков (сек)
+SNAPSHOTS_PER_PHASE = 3  # Сколько запусков каждой фазы сравнивать снимками tracemalloc
+TRACEMALLOC_FRAMES = 10  # Глубина стека для tracemalloc
+REPORT_TOP = 40  # Строк в отчётах
+PER_THREAD_CPROFILE = sys.version_info < (3, 12)  # cProfile на поток (с 3.12 допускается один профилировщик)
+
+
+class PhaseProfiler:
+    """Собирает cProfile, стеки и статистику памяти по фазам конвейера."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.active = {}  # ident потока -> имя текущей фазы
+        self.stats = {}  # фаза -> pstats.Stats
+        self.runs = {}  # фаза -> [число запусков, суммарное время]
+        self.memory = {}  # фаза -> [пик прироста памяти, список различий снимков]
+        self.stacks = {}  # свёрнутый стек -> число сэмплов
+        self.in_flight = {}  # номер запуска фазы -> [память в начале, наибольший прирост]
+        self.run_ids = itertools.count()
+        self.stop_event = threading.Event()
+        self.sampler = None
+
+    # --- Управление ---
+
+    def start(self):
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+        self.sampler.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.sampler is not None:
+            self.sampler.join()
+        self.write_reports()
+        tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name):
+        """Профилирует блок как фазу `name` в текущем потоке."""
+        ident = threading.get_ident()
+        outer = getattr(self.local, "phase", None)
+        self.local.phase = name
+        with self.lock:
+            self.active[ident] = name
+            count = self.runs.setdefault(name, [0, 0.0])[0]
+
+        # Вложенная фаза учитывается внешним cProfile, отдельный не запускаем
+        profiler = cProfile.Profile() if outer is None and PER_THREAD_CPROFILE else None
+        snapshot = tracemalloc.take_snapshot() if count < SNAPSHOTS_PER_PHASE else None
+        run_id = next(self.run_ids)
+        run_memory = [tracemalloc.get_traced_memory()[0], 0]
+        with self.lock:
+            self.in_flight[run_id] = run_memory
+        start = time.perf_counter()
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                profiler = None  # Уже активен другой профилировщик: остаются сэмплы
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - start
+            with self.lock:
+                self.in_flight.pop(run_id, None)
+            peak = max(run_memory[1], tracemalloc.get_traced_memory()[0] - run_memory[0])
+            difference = None
+            if snapshot is not None:
+                difference = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")[:REPORT_TOP]
+            with self.lock:
+                runs = self.runs[name]
+                runs[0] += 1
+                runs[1] += wall
+                memory = self.memory.setdefault(name, [0, []])
+                memory[0] = max(memory[0], peak)
+                if difference is not None:
+                    memory[1].append(difference)
+                if profiler is not None:
+                    if name in self.stats:
+                        self.stats[name].add(profiler)
+                    else:
+                        self.stats[name] = pstats.Stats(profiler)
+                if outer is None:
+                    self.active.pop(ident, None)
+                else:
+                    self.active[ident] = outer
+            self.local.phase = outer
+
+    # --- Сэмплирование стеков ---
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            current = tracemalloc.get_traced_memory()[0]
+            with self.lock:
+                active = dict(self.active)
+                for run_memory in self.in_flight.values():
+                    run_memory[1] = max(run_memory[1], current - run_memory[0])
+            if not active:
+                continue
+            frames = sys._current_frames()
+            samples = []
+            for ident, phase_name in active.items():
+                frame = frames.get(ident)
+                if frame is None or ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(phase_name)
+                samples.append(";".join(reversed(stack)))
+            with self.lock:
+                for key in samples:
+                    self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    # --- Отчёты ---
+
+    def _write_sampled_functions(self, report, name):
+        """Сводка функций фазы по сэмплам стеков: собственные и накопленные сэмплы."""
+        own, cumulative, total = {}, {}, 0
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            if frames[0] != name or len(frames) < 2:
+                continue
+            total += count
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for function in set(frames[1:]):
+                cumulative[function] = cumulative.get(function, 0) + count
+        report.write(f"Сэмплов стеков: {total} (каждые {SAMPLE_INTERVAL * 1000:.0f} мс)\n"
+                     f"{'накопл.':>8}{'собств.':>9}  функция\n")
+        for function, count in sorted(cumulative.items(), key=lambda item: -item[1])[:REPORT_TOP]:
+            report.write(f"{count:>8}{own.get(function, 0):>9}  {function}\n")
+
+    def write_reports(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with self.lock:
+            summary = ["Фаза        запусков   время, с   пик памяти, КБ"]
+            for name, (count, wall) in sorted(self.runs.items(), key=lambda item: -item[1][1]):
+                peak = self.memory.get(name, [0])[0]
+                summary.append(f"{name:<12}{count:>8}{wall:>11.3f}{peak / 1024:>17.1f}")
+
+                report = io.StringIO()
+                report.write(f"Фаза: {name}\nЗапусков: {count}\nСуммарное время: {wall:.3f} с\n"
+                             f"Пик прироста памяти: {peak / 1024:.1f} КБ\n\n")
+                stats = self.stats.get(name)
+                if stats is not None:
+                    stats.stream = report
+                    stats.sort_stats("cumulative").print_stats(REPORT_TOP)
+                    stats.dump_stats(os.path.join(self.output_dir, f"{name}.prof"))
+                else:
+                    self._write_sampled_functions(report, name)
+                for index, difference in enumerate(self.memory.get(name, [0, []])[1], 1):
+                    report.write(f"\ntracemalloc, запуск {index}: наибольшие изменения выделенной памяти\n")
+                    for stat in difference:
+                        report.write(f"  {stat}\n")
+                with open(os.path.join(self.output_dir, f"{name}.txt"), 'w', encoding='utf-8') as file:
+                    file.write(report.getvalue())
+
+            with open(os.path.join(self.output_dir, "stacks.folded"), 'w', encoding='utf-8') as file:
+                for stack, count in sorted(self.stacks.items()):
+                    file.write(f"{stack} {count}\n")
+            with open(os.path.join(self.output_dir, "summary.txt"), 'w', encoding='utf-8') as file:
+                file.write("\n".join(summary) + "\n")
+
+        print("\n".join(summary))
+        print(f"Отчёты профилирования сохранены в {self.output_dir}")
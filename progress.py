@@ -0,0 +1,243 @@
+"""
+Мультиплексор прогресса загрузок.
+
+Каждый экземпляр yt-dlp сообщает о прогрессе через progress_hooks, а этот модуль
+собирает состояние всех задач и перерисовывает одну компактную таблицу
+с фиксированной частотой вместо построчного вывода каждого потока.
+"""
+import sys
+import threading
+import time
+
+# Константы
+PROGRESS_REFRESH_INTERVAL = 0.5  # Период перерисовки таблицы (сек)
+QUIET_SUMMARY_INTERVAL = 30  # Период сводной строки в тихом режиме (сек)
+LABEL_WIDTH = 40  # Ширина колонки с названием задачи
+
+
+def format_bytes(value):
+    """Форматирует размер в байтах в читаемый вид."""
+    if value is None:
+        return "?"
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if abs(value) < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} ТБ"
+
+
+def format_eta(seconds):
+    """Форматирует оставшееся время как ЧЧ:ММ:СС."""
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressMultiplexer:
+    """
+    Агрегирует прогресс всех задач загрузки и выводит единую таблицу статуса.
+    В терминале таблица перерисовывается на месте, при выводе не в TTY
+    (файл, консоль IDE) включается тихий режим со сводными строками.
+    """
+
+    def __init__(self, refresh_interval=PROGRESS_REFRESH_INTERVAL, stream=None, quiet=None):
+        self.stream = stream or sys.stdout
+        self.refresh_interval = refresh_interval
+        if quiet is None:
+            quiet = not (hasattr(self.stream, "isatty") and self.stream.isatty())
+        self.quiet = quiet
+
+        self.lock = threading.Lock()
+        self.jobs = {}  # job_id -> состояние задачи
+        self.ended = {}  # job_id -> (подпись, успех) завершённых задач, для повторных загрузок
+        self.messages = []  # Сообщения, накопленные между перерисовками
+        self.finished_count = 0
+        self.failed_count = 0
+        self.finished_bytes = 0
+        self.start_time = time.monotonic()
+        self.last_summary = self.start_time
+        self.drawn_lines = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # --- Жизненный цикл задач ---
+
+    def begin(self, job_id, label):
+        """Регистрирует новую задачу загрузки."""
+        with self.lock:
+            self.jobs[job_id] = {
+                "label": label,
+                "status": "анализ",
+                "files": {},  # filename -> [downloaded, total, speed]
+                "started": time.monotonic(),
+                "refs": 1,  # Сколько begin/resume ещё не закрыто end
+                "ok": True,
+            }
+
+    def resume(self, job_id, label):
+        """
+        Продолжает задачу для повторной загрузки (файл не прошёл проверку).
+        Если задача ещё идёт, её строка сохраняется и только меняет состояние;
+        завершённая задача возвращается в таблицу под прежней подписью,
+        а её прошлый итог вычитается из счётчиков, чтобы ссылка не считалась дважды.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                label, ok = self.ended.pop(job_id, (label, None))
+                if ok is True:
+                    self.finished_count -= 1
+                elif ok is False:
+                    self.failed_count -= 1
+                job = self.jobs[job_id] = {"label": label, "files": {}, "started": time.monotonic(),
+                                           "refs": 0, "ok": True}
+            job["refs"] += 1
+            job["status"] = "повтор"
+
+    def end(self, job_id, ok=True):
+        """Завершает задачу (после всех её resume) и переносит её байты в общий итог."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            job["ok"] = job["ok"] and ok
+            job["refs"] -= 1
+            if job["refs"] > 0:
+                return
+            del self.jobs[job_id]
+            ok = job["ok"]
+            self.ended[job_id] = (job["label"], ok)
+            done = sum(f[0] for f in job["files"].values())
+            self.finished_bytes += done
+            if ok:
+                self.finished_count += 1
+            else:
+                self.failed_count += 1
+            if self.quiet:
+                state = "готово" if ok else "ошибка"
+                self.messages.append(f"[{state}] {job['label']} ({format_bytes(done)})")
+
+    def hook(self, job_id):
+        """Возвращает функцию для progress_hooks yt-dlp, привязанную к задаче."""
+        def _hook(d):
+            self.update(job_id, d)
+        return _hook
+
+    def update(self, job_id, d):
+        """Обрабатывает событие прогресса yt-dlp. Только обновляет состояние, без вывода."""
+        filename = d.get("filename") or d.get("tmpfilename") or ""
+        downloaded = d.get("downloaded_bytes") or 0
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            status = d.get("status")
+            if status == "downloading":
+                job["status"] = "загрузка"
+                job["files"][filename] = [downloaded, total, d.get("speed") or 0]
+                info = d.get("info_dict") or {}
+                title = info.get("title")
+                if title:
+                    job["label"] = title
+            elif status == "finished":
+                size = total or downloaded
+                job["files"][filename] = [size, size, 0]
+                job["status"] = "обработка"
+            elif status == "error":
+                job["status"] = "ошибка"
+
+    def log(self, message):
+        """Потокобезопасный вывод сообщения без разрыва таблицы."""
+        if self.thread is None:
+            print(message, file=self.stream)
+            return
+        with self.lock:
+            self.messages.append(message)
+
+    # --- Агрегация и вывод ---
+
+    def totals(self):
+        """Возвращает (скачано, известный объём, суммарная скорость, ETA) по активным задачам."""
+        downloaded = total = speed = 0
+        for job in self.jobs.values():
+            for done, size, file_speed in job["files"].values():
+                downloaded += done
+                total += size or done
+                speed += file_speed
+        eta = (total - downloaded) / speed if speed > 0 else None
+        return downloaded, total, speed, eta
+
+    def render_table(self):
+        """Формирует строки таблицы статуса (вызывается под блокировкой)."""
+        downloaded, total, speed, eta = self.totals()
+        lines = []
+        for job in self.jobs.values():
+            done = sum(f[0] for f in job["files"].values())
+            size = sum((f[1] or f[0]) for f in job["files"].values())
+            job_speed = sum(f[2] for f in job["files"].values())
+            percent = f"{done / size * 100:5.1f}%" if size else "  ?  "
+            label = job["label"][:LABEL_WIDTH].ljust(LABEL_WIDTH)
+            lines.append(f"{label} {job['status']:<9} {percent} {format_bytes(done):>10} "
+                         f"{format_bytes(job_speed):>10}/с")
+        lines.append(f"Активно: {len(self.jobs)} | Готово: {self.finished_count} | "
+                     f"Ошибки: {self.failed_count} | Скорость: {format_bytes(speed)}/с | "
+                     f"Всего: {format_bytes(self.finished_bytes + downloaded)} | ETA: {format_eta(eta)}")
+        return lines
+
+    def render(self, force=False):
+        """Перерисовывает таблицу (TTY) или печатает сводку (тихий режим)."""
+        with self.lock:
+            messages, self.messages = self.messages, []
+            if self.quiet:
+                now = time.monotonic()
+                out = messages
+                if force or now - self.last_summary >= QUIET_SUMMARY_INTERVAL:
+                    out = out + self.render_table()[-1:]
+                    self.last_summary = now
+                if out:
+                    self.stream.write("\n".join(out) + "\n")
+                    self.stream.flush()
+                return
+
+            buffer = []
+            if self.drawn_lines:
+                # Возвращаем курсор к началу таблицы и очищаем её
+                buffer.append(f"\x1b[{self.drawn_lines}F\x1b[J")
+            buffer.extend(m + "\n" for m in messages)
+            table = self.render_table()
+            buffer.append("\n".join(table) + "\n")
+            self.drawn_lines = len(table)
+            self.stream.write("".join(buffer))
+            self.stream.flush()
+
+    def _run(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            self.render()
+
+    def start(self):
+        """Запускает фоновую перерисовку."""
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self._run, name="progress", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Останавливает перерисовку и выводит итоговое состояние."""
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.render(force=True)
+        self.thread = None
+        elapsed = time.monotonic() - self.start_time
+        average = self.finished_bytes / elapsed if elapsed > 0 else 0
+        print(f"Загрузки завершены за {elapsed:.1f} сек, средняя скорость {format_bytes(average)}/с",
+              file=self.stream)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
@@ -1,10 +1,38 @@
-import shutil
+import os
 from pathlib import Path
 
+from fileops import MovePool, same_device
+
+
+def plan_targets(files, target_names):
+    """
+    Подбирает каждому файлу свободное имя в целевой папке без обращений к диску.
+
+    :param files: Пути файлов в порядке перемещения.
+    :param target_names: Множество имён, уже занятых в целевой папке (в виде os.path.normcase).
+    :return: Список (путь, новое имя).
+    """
+    plan = []
+    for file in files:
+        name = file.name
+        conflict_counter = 0
+        while os.path.normcase(name) in target_names:
+            conflict_counter += 1
+            name = f"{file.stem}_{conflict_counter}{file.suffix}"
+        target_names.add(os.path.normcase(name))
+        plan.append((file, name))
+    return plan
+
+
 def move_files_back(source_directory, target_directory):
     """
     Перемещает все файлы из указанной папки обратно в другую папку.
 
+    Имена целевой папки читаются один раз, конфликты разрешаются в памяти,
+    а перемещения выполняются пулом: в пределах тома — переименованием,
+    между томами — копированием в ограниченном пуле потоков. Если целевой папки
+    нет, а в исходной нет подпапок, папка переносится целиком одним переименованием.
+
     :param source_directory: Папка, из которой перемещаются файлы.
     :param target_directory: Папка, куда перемещаются файлы.
     """
@@ -16,32 +44,55 @@ def move_files_back(source_directory, target_directory):
             print(f"Ошибка: Папка источника '{source_directory}' не существует или не является директорией.")
             return
 
-        if not target.exists():
-            target.mkdir(parents=True)
-            print(f"Создана целевая папка: {target_directory}")
-
-        files = [f for f in source.rglob("*") if f.is_file()]
+        # Один проход по дереву источника
+        files = []
+        has_subfolders = False
+        for root, directories, names in os.walk(source):
+            has_subfolders = has_subfolders or bool(directories)
+            files.extend(Path(root) / name for name in names)
         if not files:
             print("Нет файлов для перемещения.")
             return
 
-        for file in files:
+        # Целевой папки нет: переносим всю папку одним переименованием и оставляем пустой источник
+        if not target.exists() and not has_subfolders and target.parent.exists() \
+                and same_device(source, target):
             try:
-                target_file = target / file.name
+                os.rename(source, target)
+            except OSError:
+                pass  # Не удалось (например, папка занята): перемещаем по файлам
+            else:
+                print(f"Папка {source_directory} целиком перемещена в {target_directory} ({len(files)} файлов).")
+                # Файлы уже в целевой папке: при ошибке здесь нельзя переходить к переносу по файлам
+                try:
+                    source.mkdir()
+                except OSError as e:
+                    print(f"Предупреждение: не удалось заново создать пустую папку {source_directory}: {e}")
+                return
 
-                # Проверяем на конфликты и создаем уникальное имя при необходимости
-                conflict_counter = 0
-                while target_file.exists():
-                    conflict_counter += 1
-                    target_file = target / f"{file.stem}_{conflict_counter}{file.suffix}"
+        if not target.exists():
+            target.mkdir(parents=True)
+            print(f"Создана целевая папка: {target_directory}")
 
-                shutil.move(str(file), str(target_file))
-                print(f"Файл {file.name} перемещен в {target_directory}.")
+        # Снимок имён целевой папки и разрешение конфликтов в памяти
+        target_names = {os.path.normcase(name) for name in os.listdir(target)}
+        plan = plan_targets(files, target_names)
 
-            except Exception as e:
-                print(f"Ошибка при перемещении файла {file}: {e}")
+        errors = []
+        source_device = os.stat(source).st_dev
+        with MovePool() as mover:
+            for file, name in plan:
+                if name != file.name:
+                    print(f"Файл {file.name} переименован в {name} из-за конфликта имён.")
+                try:
+                    mover.move(file, target / name, source_device)
+                except Exception as e:
+                    errors.append((file, e))
+        errors.extend(mover.errors)
 
-        print("Перемещение завершено.")
+        for file, error in errors:
+            print(f"Ошибка при перемещении файла {file}: {error}")
+        print(f"Перемещение завершено. Перемещено файлов: {len(plan) - len(errors)} в {target_directory}.")
 
     except Exception as e:
         print(f"Критическая ошибка: {e}")
@@ -49,4 +100,4 @@ def move_files_back(source_directory, target_directory):
 # Пример использования
 source_directory = r"F:\м\0028"  # Укажите текущую папку
 target_directory = "F:\\Загрузки"  # Укажите папку для возврата
-move_files_back(source_directory, target_directory)
\ No newline at end of file
+move_files_back(source_directory, target_directory)
@@ -0,0 +1,109 @@
+"""
+Потоковое сканирование "свалки" файлов для организаторов (update.py, del meta.py).
+
+Файлы перечисляются через os.scandir, размер и время изменения берутся из
+DirEntry.stat() (на Windows — без дополнительных системных вызовов), а каждая
+запись хранится как компактный кортеж, который сортируется без функции-ключа.
+Если файлов больше chunk_size, используется внешняя сортировка: отсортированные
+порции сбрасываются во временные файлы и сливаются потоково. Несколько папок
+сливаются в одну последовательность так же — кучей по их отсортированным потокам.
+"""
+import heapq
+import os
+import pickle
+import shutil
+import tempfile
+from collections import namedtuple
+
+# Константы
+SORT_CHUNK_SIZE = 1_000_000  # Записей в памяти до сброса порции на диск
+SPILL_BATCH_SIZE = 4096  # Записей в одном pickle-блоке временного файла
+
+# Порядок полей задаёт порядок сортировки: по дате изменения, затем по имени без учёта регистра
+FileRecord = namedtuple("FileRecord", ["mtime", "sort_name", "name", "size"])
+
+
+def scan_files(directory):
+    """Генерирует FileRecord для обычных файлов папки (без подпапок)."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue  # Файл удалён во время сканирования
+            yield FileRecord(stat.st_mtime, entry.name.lower(), entry.name, stat.st_size)
+
+
+def _write_chunk(records, directory, index):
+    path = os.path.join(directory, f"chunk{index:06d}.pickle")
+    with open(path, 'wb') as file:
+        for start in range(0, len(records), SPILL_BATCH_SIZE):
+            pickle.dump(records[start:start + SPILL_BATCH_SIZE], file, protocol=pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _read_chunk(path):
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                return
+            for record in batch:
+                yield FileRecord._make(record)
+
+
+def sorted_files(directory, chunk_size=SORT_CHUNK_SIZE):
+    """
+    Генерирует FileRecord папки в порядке (mtime, имя без учёта регистра).
+
+    Пока файлов не больше chunk_size, сортировка идёт в памяти. Иначе
+    отсортированные порции пишутся во временные файлы и сливаются heapq.merge,
+    так что в памяти одновременно находится одна порция при сканировании
+    и по одному блоку из каждой порции при слиянии.
+    """
+    records = []
+    spill_dir = None
+    chunks = []
+    try:
+        for record in scan_files(directory):
+            records.append(record)
+            if chunk_size and len(records) >= chunk_size:
+                if spill_dir is None:
+                    spill_dir = tempfile.mkdtemp(prefix="scan_sort_")
+                records.sort()
+                chunks.append(_write_chunk(records, spill_dir, len(chunks)))
+                records = []
+
+        records.sort()
+        if not chunks:
+            yield from records
+            return
+        if records:
+            chunks.append(_write_chunk(records, spill_dir, len(chunks)))
+            records = []
+        yield from heapq.merge(*(_read_chunk(path) for path in chunks))
+    finally:
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def _tagged(directory, records):
+    for record in records:
+        yield directory, record
+
+
+def merged_files(directories, chunk_size=SORT_CHUNK_SIZE):
+    """
+    Генерирует пары (папка, FileRecord) из нескольких папок в общем порядке
+    (mtime, имя без учёта регистра). Каждая папка сортируется своим потоком
+    sorted_files с долей chunk_size, а потоки сливаются heapq.merge, так что
+    общий список файлов не строится. При полном совпадении ключа раньше идёт
+    папка, указанная раньше.
+    """
+    directories = list(directories)
+    share = max(1, chunk_size // len(directories)) if chunk_size and directories else chunk_size
+    streams = [_tagged(directory, sorted_files(directory, share)) for directory in directories]
+    return heapq.merge(*streams, key=lambda item: item[1])
@@ -1,130 +1,473 @@
+import argparse
+import errno
+import itertools
+import json
 import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
-def organize_files(source_directory, result_directory, max_files_per_folder=5000, start_number=None):
+from dedup import DUPLICATE_POLICIES, DedupIndex, find_duplicates
+from fileops import move_file
+from journal import MoveJournal
+from scanner import merged_files
+
+STATE_FILENAME = ".organize_state.json"  # Файл состояния в результирующей папке
+PLAN_VERSION = 1  # Версия формата файла плана
+EXECUTE_WORKERS = 8  # Потоков при выполнении плана
+EXECUTE_BATCH = 1000  # Записей плана, читаемых и выполняемых за один пакет
+
+
+def scan_occupancy(result):
     """
-    Организует файлы из "свалки" в упорядоченные папки с указанным лимитом файлов на папку.
+    Одним проходом по результирующей папке строит индекс заполненности.
 
-    :param source_directory: Путь к "свалке" файлов.
-    :param result_directory: Путь к папке с результатом.
-    :param max_files_per_folder: Максимальное количество файлов на одну папку.
-    :param start_number: Начальное число для нумерации файлов. Если None, определяется автоматически.
+    :return: (словарь {номер папки: число файлов}, последний номер файла в последней папке)
     """
+    occupancy = {}
+    with os.scandir(result) as entries:
+        folders = [entry for entry in entries if entry.is_dir() and entry.name.isdigit()]
+    last_number = 0
+    for folder in sorted(folders, key=lambda entry: int(entry.name)):
+        count = 0
+        numbers = []
+        with os.scandir(folder.path) as entries:
+            for entry in entries:
+                count += 1
+                stem = os.path.splitext(entry.name)[0]
+                if stem.isdigit() and entry.is_file():
+                    numbers.append(int(stem))
+        occupancy[int(folder.name)] = count
+        if numbers:
+            last_number = max(numbers)  # Номер берётся из последней непустой папки
+    return occupancy, last_number
+
+
+def folder_mtime(path):
     try:
-        # Конвертируем пути в Path-объекты
-        source = Path(source_directory)
-        result = Path(result_directory)
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
 
-        # Проверяем существование папок
-        if not source.exists() or not source.is_dir():
-            print(f"Ошибка: Папка источника '{source_directory}' не существует или не является директорией.")
-            return
-        if not result.exists():
-            result.mkdir(parents=True)
-            print(f"Создана результирующая папка: {result_directory}")
 
-        # Получаем список файлов из "свалки"
-        files = [f for f in source.iterdir() if f.is_file()]
-        if not files:
-            print("Нет файлов для обработки.")
-            return
+def load_state(result):
+    """
+    Читает сохранённый индекс заполненности. Состояние считается актуальным,
+    только если с момента сохранения не менялись ни результирующая папка,
+    ни последняя папка с файлами; иначе возвращается None.
+    """
+    try:
+        with open(result / STATE_FILENAME, 'r', encoding='utf-8') as file:
+            state = json.load(file)
+        occupancy = {int(name): count for name, count in state["occupancy"].items()}
+        if folder_mtime(result) != state["result_mtime"]:
+            return None
+        if occupancy:
+            last_folder = result / f"{max(occupancy):04d}"
+            if folder_mtime(last_folder) != state["last_folder_mtime"]:
+                return None
+        return occupancy, state["last_number"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_state(result, occupancy, last_number):
+    """Сохраняет индекс заполненности, чтобы следующий запуск не сканировал дерево."""
+    state_path = result / STATE_FILENAME
+    # Файл создаётся до замера mtime: перезапись содержимого существующего файла mtime папки не меняет
+    state_path.touch(exist_ok=True)
+    last_folder = result / f"{max(occupancy):04d}" if occupancy else None
+    state = {
+        "occupancy": {f"{number:04d}": count for number, count in occupancy.items()},
+        "last_number": last_number,
+        "result_mtime": folder_mtime(result),
+        "last_folder_mtime": folder_mtime(last_folder) if last_folder else None,
+    }
+    with open(state_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file)
 
-        # Сортируем файлы по дате последнего изменения (от старого к новому), затем по имени (в порядке возрастания)
-        files.sort(key=lambda f: (f.stat().st_mtime, f.name.lower()))
-
-        # Определяем начальный номер
-        if start_number is None:
-            # Сканируем существующую структуру для определения последнего номера
-            existing_folders = sorted(result.glob("*/"), key=lambda f: f.name)
-            if existing_folders:
-                last_folder = existing_folders[-1]
-                last_file = max(
-                    (int(f.stem) for f in last_folder.iterdir() if f.is_file() and f.stem.isdigit()),
-                    default=0
-                )
-                start_number = last_file + 1
+
+def build_plan(sources, result, plan_path, max_files_per_folder=5000, start_number=None, duplicates=None):
+    """
+    Строит полный план раскладки, ничего не меняя на диске: для каждого файла —
+    целевая папка и имя с учётом границ папок, нумерации и конфликтов имён.
+
+    План записывается в plan_path в формате JSON Lines: первая строка — заголовок
+    со сводкой, далее по строке на файл (src, dst, mtime, size и сведения о дубликате).
+    Все пути в плане абсолютные.
+
+    :return: Заголовок плана или None, если файлов нет.
+    """
+    # Пути в плане абсолютные: --apply может запускаться из другой рабочей папки
+    sources = [Path(os.path.abspath(source)) for source in sources]
+    result = Path(os.path.abspath(result))
+
+    # Получаем файлы из "свалок", отсортированные по дате последнего изменения (от старого к новому),
+    # затем по имени (в порядке возрастания). Дата и размер берутся из одного сканирования,
+    # а несколько "свалок" сливаются потоково, без общего списка файлов
+    records = merged_files(sources)
+    first = next(records, None)
+    if first is None:
+        return None
+    records = itertools.chain([first], records)
+
+    # Индекс заполненности: из файла состояния или одним сканированием дерева.
+    # Состояние проверяется до открытия индекса дубликатов: его файл и журнал SQLite
+    # лежат в результирующей папке, и их создание меняет её mtime
+    state = load_state(result)
+
+    # Поиск дубликатов по содержимому (требует полного списка файлов)
+    found, hashes, placed = {}, {}, {}
+    if duplicates is not None:
+        records = list(records)
+        dedup_index = DedupIndex(result)
+        try:
+            found, hashes = find_duplicates(
+                [(str(source / record.name), record.size) for source, record in records], dedup_index)
+        finally:
+            dedup_index.close()
+        print(f"Найдено дубликатов: {len(found)}")
+
+    if state is None:
+        occupancy, last_number = scan_occupancy(result)
+    else:
+        occupancy, last_number = state
+        print("Индекс заполненности загружен из файла состояния.")
+
+    # Определяем начальный номер
+    if start_number is None:
+        start_number = last_number + 1
+
+    base = {}  # Существующие папки, которые план дописывает: {имя: число записей в них}
+    new_folders = []
+
+    def next_folder(number):
+        """Первая незаполненная папка начиная с number: (номер, множество имён в ней)."""
+        while True:
+            folder = result / f"{number:04d}"
+            if folder.is_dir():
+                names = set(os.listdir(folder))
+                occupancy[number] = len(names)
+                if len(names) < max_files_per_folder:
+                    base[folder.name] = len(names)
+                    return number, names
             else:
-                start_number = 1
+                occupancy[number] = 0
+                new_folders.append(folder.name)
+                return number, set()
+            number += 1
 
-        # Счетчики
-        file_counter = start_number
-        rename_counter = 0
+    # Работа с последней папкой: дописываем её, если она не заполнена
+    folder_counter, names = next_folder(max(occupancy) if occupancy else 1)
 
-        # Работа с последней папкой
-        existing_folders = sorted(result.glob("*/"), key=lambda f: f.name)
-        if existing_folders:
-            current_folder = existing_folders[-1]
-            folder_counter = int(current_folder.name)  # Установим номер последней папки
-        else:
-            folder_counter = 1
-            current_folder = result / f"{folder_counter:04d}"
-            current_folder.mkdir()
-            print(f"Создана первая папка: {current_folder}")
-
-        # Проверяем заполняемость последней папки
-        while len(list(current_folder.iterdir())) >= max_files_per_folder:
-            folder_counter += 1
-            current_folder = result / f"{folder_counter:04d}"
-            if not current_folder.exists():
-                current_folder.mkdir()
-                print(f"Создана новая папка: {current_folder}")
-
-        # Обработка файлов
-        for file in files:
-            # Формируем новое имя файла
-            new_name = f"{file_counter:06d}{file.suffix}"
-            new_path = current_folder / new_name
+    stats = {"files": 0, "bytes": 0, "conflicts": 0, "skipped": 0, "linked": 0, "reported": 0, "extensions": {}}
+    file_counter = start_number
+    body_path = plan_path + ".part"
+    with open(body_path, 'w', encoding='utf-8') as body:
+        for source, record in records:
+            file = source / record.name
+            original = found.get(str(file))
+            if original is not None and duplicates == "skip":
+                stats["skipped"] += 1
+                continue
 
-            # Проверяем дубликаты
+            # Папка заполнена — переходим к следующей
+            if occupancy[folder_counter] >= max_files_per_folder:
+                folder_counter, names = next_folder(folder_counter + 1)
+
+            # Формируем новое имя файла, конфликты проверяются по снимку имён папки
+            new_name = f"{file_counter:06d}{file.suffix}"
             conflict_counter = 0
-            while new_path.exists():
+            while new_name in names:
                 conflict_counter += 1
                 new_name = f"{file_counter:06d}_{conflict_counter}{file.suffix}"
-                new_path = current_folder / new_name
+            if conflict_counter:
+                stats["conflicts"] += 1
+            names.add(new_name)
+            new_path = str(result / f"{folder_counter:04d}" / new_name)
 
-            # Перемещаем файл
-            try:
-                file.rename(new_path)
-            except Exception as e:
-                print(f"Ошибка перемещения файла {file}: {e}")
-                continue  # Продолжаем работу даже при ошибке
+            entry = {"src": str(file), "dst": new_path, "mtime": record.mtime, "size": record.size}
+            if original is not None:
+                entry["original"] = placed.get(original, original)
+                if duplicates == "hardlink":
+                    entry["op"] = "link"
+                    stats["linked"] += 1
+                else:
+                    print(f"Дубликат: {file} = {entry['original']}")
+                    stats["reported"] += 1
+            elif str(file) in hashes:
+                entry["partial"], entry["full"] = hashes[str(file)]
+                if entry["full"] is not None:
+                    placed[str(file)] = new_path
+            body.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
-            # Увеличиваем счетчик файлов
+            stats["files"] += 1
+            stats["bytes"] += record.size
+            extension = file.suffix.lower() or "(без расширения)"
+            stats["extensions"][extension] = stats["extensions"].get(extension, 0) + 1
             file_counter += 1
-            rename_counter += 1
-
-            # Проверяем, если текущая папка заполнена, создаем новую
-            if len(list(current_folder.iterdir())) >= max_files_per_folder:
-                folder_counter += 1
-                current_folder = result / f"{folder_counter:04d}"
-                current_folder.mkdir()
-                print(f"Создана новая папка: {current_folder}")
-
-            # Проверяем каждые 100 переименований
-            if rename_counter == 100:
-                print("Проверка: обработано 100 файлов. Результат корректен?")
-                user_input = input("Введите 'да' для продолжения без остановки, 'нет' для остановки: ").strip().lower()
-                if user_input == 'да':
-                    print("Продолжаем обработку без остановок.")
-                elif user_input == 'нет':
-                    print("Обработка прервана пользователем.")
-                    break
+            occupancy[folder_counter] += 1
+
+    header = {
+        "plan": PLAN_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "sources": [str(source) for source in sources],
+        "result": str(result),
+        "max_files_per_folder": max_files_per_folder,
+        "duplicates": duplicates,
+        "first_number": start_number,
+        "last_number": file_counter - 1 if stats["files"] else last_number,
+        "base": base,
+        "new_folders": new_folders if stats["files"] else [],
+        "occupancy": {f"{number:04d}": count for number, count in occupancy.items() if count},
+        "stats": stats,
+    }
+    with open(plan_path, 'w', encoding='utf-8') as plan, open(body_path, 'r', encoding='utf-8') as body:
+        plan.write(json.dumps(header, ensure_ascii=False) + "\n")
+        shutil.copyfileobj(body, plan)
+    os.remove(body_path)
+    return header
+
+
+def print_plan_summary(header):
+    """Выводит сводку плана для проверки перед выполнением."""
+    stats = header["stats"]
+    print(f"План от {header['created']}: {stats['files']} файлов, {stats['bytes'] / 1024 ** 3:.2f} ГБ")
+    if stats["files"]:
+        print(f"Номера: {header['first_number']:06d}–{header['last_number']:06d}")
+    for name, count in header["base"].items():
+        print(f"Дописывается папка {name} (сейчас файлов: {count})")
+    if header["new_folders"]:
+        print(f"Новых папок: {len(header['new_folders'])} "
+              f"({header['new_folders'][0]}–{header['new_folders'][-1]})")
+    if stats["conflicts"]:
+        print(f"Переименовано из-за конфликтов имён: {stats['conflicts']}")
+    if header["duplicates"]:
+        print(f"Дубликаты: оставлено в источнике {stats['skipped']}, жёсткими ссылками {stats['linked']}, "
+              f"в отчёте {stats['reported']}")
+    extensions = sorted(stats["extensions"].items(), key=lambda item: item[1], reverse=True)
+    if extensions:
+        print("Форматы: " + ", ".join(f"{extension} — {count}" for extension, count in extensions[:10]))
+
+
+def read_plan(plan_path):
+    """Возвращает (заголовок, генератор записей) файла плана."""
+    file = open(plan_path, 'r', encoding='utf-8')
+    try:
+        header = json.loads(file.readline())
+    except ValueError:
+        file.close()
+        raise ValueError(f"'{plan_path}' не является файлом плана.")
+    if header.get("plan") != PLAN_VERSION:
+        file.close()
+        raise ValueError(f"Неподдерживаемая версия плана: {header.get('plan')}")
+
+    def entries():
+        with file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    return header, entries()
+
+
+def execute_plan(plan_path, max_workers=EXECUTE_WORKERS):
+    """
+    Выполняет план: создаёт новые папки и перемещает файлы пакетами в пуле потоков.
+    Дубликаты-ссылки создаются после всех перемещений, когда оригиналы уже на месте.
+
+    Перед началом проверяется, что дописываемые папки не изменились с момента
+    построения плана, а новые папки пусты; целевые файлы никогда не перезаписываются.
+
+    :return: Словарь с числом перемещённых, связанных и неудачных файлов или None, если план устарел.
+    """
+    header, entries = read_plan(plan_path)
+    result = Path(header["result"])
+
+    # Проверяем, что план ещё применим
+    stale = [name for name, count in header["base"].items()
+             if not (result / name).is_dir() or len(os.listdir(result / name)) != count]
+    stale += [name for name in header["new_folders"] if (result / name).exists() and os.listdir(result / name)]
+    if stale:
+        entries.close()
+        print(f"План устарел: изменились папки {', '.join(stale)}. Постройте план заново.")
+        return None
+
+    for name in header["new_folders"]:
+        (result / name).mkdir(parents=True, exist_ok=True)
+
+    occupancy = {int(name): count for name, count in header["occupancy"].items()}
+    counts = {"moved": 0, "linked": 0, "errors": 0}
+    lock = threading.Lock()
+    dedup_index = DedupIndex(result) if header.get("duplicates") else None
+    # Каждое перемещение записывается в журнал до выполнения,
+    # поэтому прерванный запуск можно отменить: python journal.py undo <результат>
+    journal = MoveJournal(result, "update")
+
+    def apply(entry):
+        source, target = entry["src"], entry["dst"]
+        try:
+            if os.path.lexists(target):
+                raise FileExistsError(errno.EEXIST, "целевой файл уже существует", target)
+            if entry.get("op") == "link":
+                journal.record(source, target, entry["mtime"], kind="link")
+                try:
+                    os.link(entry["original"], target)
+                except OSError:
+                    pass  # Оригинал недоступен или ФС без жёстких ссылок: перемещаем как обычный файл
                 else:
-                    print("Некорректный ввод. Обработка прервана.")
+                    os.remove(source)
+                    return "linked"
+            journal.record(source, target, entry["mtime"])
+            # В пределах тома — переименование, между томами — копирование ядром с проверкой размера
+            move_file(source, target)
+            if dedup_index is not None and "original" not in entry:
+                dedup_index.add(target, entry["size"], entry.get("partial"), entry.get("full"))
+            return "moved"
+        except OSError as e:
+            print(f"Ошибка перемещения файла {source}: {e}")
+            with lock:
+                occupancy[int(os.path.basename(os.path.dirname(target)))] -= 1
+            return "errors"
+
+    total = header["stats"]["files"]
+    done = 0
+    links = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="apply") as executor:
+            while True:
+                batch = list(itertools.islice(entries, EXECUTE_BATCH))
+                if not batch:
                     break
+                moves = []
+                for entry in batch:
+                    (links if entry.get("op") == "link" else moves).append(entry)
+                for outcome in executor.map(apply, moves):
+                    counts[outcome] += 1
+                done += len(moves)
+                print(f"Выполнено: {done}/{total}")
+            if links:
+                for outcome in executor.map(apply, links):
+                    counts[outcome] += 1
+                print(f"Выполнено: {done + len(links)}/{total}")
+    finally:
+        journal.close()
+        if dedup_index is not None:
+            dedup_index.close()
 
-        print(f"Обработка завершена. Всего обработано файлов: {file_counter - start_number}")
-        print(f"Создано папок: {folder_counter}")
+    save_state(result, occupancy, header["last_number"])
+    return counts
+
+
+def organize_files(source_directory, result_directory, max_files_per_folder=5000, start_number=None,
+                   duplicates=None, plan_path=None, max_workers=EXECUTE_WORKERS):
+    """
+    Организует файлы из "свалки" в упорядоченные папки с указанным лимитом файлов на папку.
+    Сначала строится полный план раскладки, затем он выполняется без остановок.
+
+    :param source_directory: Путь к "свалке" файлов или список путей к нескольким "свалкам".
+        Файлы всех "свалок" нумеруются одной последовательностью по дате изменения.
+    :param result_directory: Путь к папке с результатом.
+    :param max_files_per_folder: Максимальное количество файлов на одну папку.
+    :param start_number: Начальное число для нумерации файлов. Если None, определяется автоматически.
+    :param duplicates: Что делать с дубликатами по содержимому: None — не искать,
+        "skip" — оставить в "свалке", "hardlink" — разложить жёсткой ссылкой на оригинал,
+        "report" — разложить как обычно и вывести список.
+    :param plan_path: Если задан, план только записывается в этот файл для проверки;
+        выполнить его можно позже: python update.py --apply <план>.
+    :param max_workers: Потоков при выполнении плана.
+    """
+    try:
+        # Конвертируем пути в Path-объекты
+        if isinstance(source_directory, (list, tuple)):
+            sources = [Path(directory) for directory in source_directory]
+        else:
+            sources = [Path(source_directory)]
+        result = Path(result_directory)
+
+        # Проверяем существование папок
+        for source in sources:
+            if not source.exists() or not source.is_dir():
+                print(f"Ошибка: Папка источника '{source}' не существует или не является директорией.")
+                return
+        if duplicates is not None and duplicates not in DUPLICATE_POLICIES:
+            print(f"Ошибка: неизвестный режим дубликатов '{duplicates}'.")
+            return
+        if not result.exists():
+            result.mkdir(parents=True)
+            print(f"Создана результирующая папка: {result_directory}")
+
+        # Строим план: в указанный файл для проверки или во временный для немедленного выполнения
+        if plan_path is None:
+            descriptor, path = tempfile.mkstemp(prefix="organize_plan_", suffix=".jsonl")
+            os.close(descriptor)
+        else:
+            path = str(plan_path)
+        try:
+            header = build_plan(sources, result, path, max_files_per_folder, start_number, duplicates)
+            if header is None:
+                print("Нет файлов для обработки.")
+                return
+            print_plan_summary(header)
+            if plan_path is not None:
+                print(f"План записан в {path}. Выполнить: python update.py --apply \"{path}\"")
+                return
+
+            counts = execute_plan(path, max_workers)
+        finally:
+            if plan_path is None and os.path.exists(path):
+                os.remove(path)
+
+        if counts is not None:
+            print(f"Обработка завершена. Всего обработано файлов: {counts['moved'] + counts['linked']}")
+            if counts["linked"]:
+                print(f"Дубликатов разложено жёсткими ссылками: {counts['linked']}")
+            if counts["errors"]:
+                print(f"Ошибок: {counts['errors']}")
+            print(f"Создано папок: {len(header['new_folders'])}")
 
     except Exception as e:
         print(f"Критическая ошибка: {e}")
 
 
-# Пример использования
-source_directory = "F:\\Загрузки"
-result_directory = "F:\\м"
-max_files_per_folder = 5000
-start_number = None  # Автоматически определить стартовый номер
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Раскладка файлов из \"свалки\" по нумерованным папкам. "
+                    "Без аргументов используются значения из примера внизу файла.")
+    parser.add_argument("--source", nargs="+", metavar="DIR", help="папки-источники")
+    parser.add_argument("--result", metavar="DIR", help="результирующая папка")
+    parser.add_argument("--max-files", type=int, help="файлов на папку (по умолчанию 5000)")
+    parser.add_argument("--start", type=int, help="начальный номер (по умолчанию — следующий за последним)")
+    parser.add_argument("--duplicates", choices=DUPLICATE_POLICIES, help="что делать с дубликатами")
+    parser.add_argument("--plan", metavar="FILE", help="только построить план и записать его в FILE")
+    parser.add_argument("--apply", metavar="FILE", help="выполнить ранее построенный план")
+    parser.add_argument("--workers", type=int, default=EXECUTE_WORKERS, help="потоков при выполнении плана")
+    return parser.parse_args()
+
 
-organize_files(source_directory, result_directory, max_files_per_folder, start_number)
\ No newline at end of file
+# Пример использования (под защитой __main__: пул процессов поиска дубликатов импортирует этот модуль)
+if __name__ == "__main__":
+    source_directory = "F:\\Загрузки"  # Или список папок: ["F:\\Загрузки", "E:\\Загрузки"]
+    result_directory = "F:\\м"
+    max_files_per_folder = 5000
+    start_number = None  # Автоматически определить стартовый номер
+    duplicates = None  # Дубликаты: None (не искать), "skip", "hardlink" или "report"
+
+    args = parse_args()
+    if args.apply:
+        try:
+            counts = execute_plan(args.apply, args.workers)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка: {e}")
+        else:
+            if counts is not None:
+                print(f"Перемещено: {counts['moved']}, жёсткими ссылками: {counts['linked']}, "
+                      f"ошибок: {counts['errors']}")
+    else:
+        organize_files(args.source or source_directory, args.result or result_directory,
+                       args.max_files or max_files_per_folder,
+                       args.start if args.start is not None else start_number,
+                       args.duplicates or duplicates, args.plan, args.workers)
@@ -0,0 +1,187 @@
+"""
+Проверка целостности скачанных файлов.
+
+Проверка запускается сразу после того, как yt-dlp переместил готовый файл,
+и выполняется в отдельном пуле параллельно с остальными загрузками:
+ffprobe проверяет контейнер и длительность, потоковый SHA-256 записывается
+в каталог. Повреждённые файлы удаляются и ставятся в очередь повторно.
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Константы
+VERIFY_WORKERS = 2  # Потоков проверки (ffprobe и хэширование не держат GIL)
+MAX_VERIFY_ATTEMPTS = 3  # Сколько раз скачивать файл, не прошедший проверку
+DURATION_TOLERANCE = 2.0  # Допустимое расхождение длительности (сек)
+DURATION_TOLERANCE_RATIO = 0.02  # ...или доля от ожидаемой длительности
+HASH_CHUNK_SIZE = 1024 * 1024  # Размер блока при хэшировании
+FFPROBE_TIMEOUT = 120  # Таймаут ffprobe (сек)
+
+
+def file_sha256(path):
+    """Потоково вычисляет SHA-256 файла."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def probe_media(path):
+    """
+    Проверяет контейнер через ffprobe.
+    Возвращает (ok, длительность или None, описание ошибки).
+    """
+    command = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'json', path,
+    ]
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, timeout=FFPROBE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        return False, None, "ffprobe: превышено время ожидания"
+    if completed.returncode != 0:
+        return False, None, completed.stderr.strip() or f"ffprobe: код возврата {completed.returncode}"
+    try:
+        duration = float(json.loads(completed.stdout)["format"]["duration"])
+    except (ValueError, KeyError, TypeError):
+        duration = None
+    if completed.stderr.strip():
+        return False, duration, completed.stderr.strip().splitlines()[0]
+    return True, duration, ""
+
+
+class Verifier:
+    """
+    Пул проверки готовых файлов.
+
+    requeue(job) вызывается для повторной загрузки повреждённого файла и должен
+    вернуть Future загрузки; job — словарь с ключами url, is_playlist,
+    playlist_range, attempt и catalog. join() ждёт, пока не останется ни проверок,
+    ни повторных загрузок. Результат записывается в каталог, переданный в хук,
+    а если он не задан — в каталог самого Verifier.
+    """
+
+    def __init__(self, catalog=None, requeue=None, output=print, max_workers=VERIFY_WORKERS):
+        self.catalog = catalog
+        self.requeue = requeue
+        self.output = output
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="verify")
+        self.has_ffprobe = shutil.which("ffprobe") is not None
+        if not self.has_ffprobe:
+            output("ffprobe не найден. Проверяется только размер, хэш записывается в каталог.")
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.verified_count = 0
+        self.corrupt_count = 0
+
+    def _acquire(self):
+        with self.condition:
+            self.pending += 1
+
+    def _release(self, *_):
+        with self.condition:
+            self.pending -= 1
+            if self.pending == 0:
+                self.condition.notify_all()
+
+    def postprocessor_hook(self, url, is_playlist=False, attempt=1, catalog=None):
+        """Хук postprocessor_hooks yt-dlp: ставит готовый файл на проверку."""
+        def _hook(d):
+            if d.get("postprocessor") == "MoveFiles" and d.get("status") == "finished":
+                info = d.get("info_dict") or {}
+                if info.get("filepath"):
+                    self.submit(info["filepath"], url, info, is_playlist, attempt, catalog)
+        return _hook
+
+    def submit(self, path, url, info, is_playlist=False, attempt=1, catalog=None):
+        """Ставит файл в очередь проверки."""
+        self._acquire()
+        future = self.executor.submit(self._verify, path, url, info, is_playlist, attempt,
+                                      catalog or self.catalog)
+        future.add_done_callback(self._release)
+
+    def _verify(self, path, url, info, is_playlist, attempt, catalog):
+        try:
+            ok, reason, duration = self.check(path, info.get("duration"))
+            sha256 = None
+            if os.path.exists(path):
+                sha256 = file_sha256(path)
+            status = "ok" if ok else "corrupt"
+            if ok and not self.has_ffprobe:
+                status = "unverified"
+            if catalog is not None:
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                catalog.record_verification(path, url, size, sha256, duration, status)
+            with self.condition:
+                if ok:
+                    self.verified_count += 1
+                else:
+                    self.corrupt_count += 1
+            if not ok:
+                self._handle_corrupt(path, url, info, is_playlist, attempt, reason, catalog)
+        except Exception as e:
+            self.output(f"Ошибка при проверке файла {path}: {e}")
+
+    def check(self, path, expected_duration):
+        """Возвращает (ok, причина, фактическая длительность)."""
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return False, "файл отсутствует или пустой", None
+        if not self.has_ffprobe:
+            return True, "", None
+        ok, duration, reason = probe_media(path)
+        if not ok:
+            return False, reason, duration
+        if expected_duration and duration is not None:
+            tolerance = max(DURATION_TOLERANCE, expected_duration * DURATION_TOLERANCE_RATIO)
+            if abs(duration - expected_duration) > tolerance:
+                return False, f"длительность {duration:.1f} с вместо {expected_duration:.1f} с", duration
+        return True, "", duration
+
+    def _handle_corrupt(self, path, url, info, is_playlist, attempt, reason, catalog):
+        self.output(f"Файл не прошёл проверку ({reason}): {path}")
+        if self.requeue is None or attempt >= MAX_VERIFY_ATTEMPTS:
+            self.output(f"Файл оставлен как повреждённый после {attempt} попыток: {path}")
+            return
+        try:
+            # yt-dlp пропускает существующие файлы, поэтому повреждённый удаляем
+            os.remove(path)
+        except OSError:
+            pass
+        playlist_index = info.get("playlist_index")
+        job = {
+            "url": url,
+            "is_playlist": bool(is_playlist and playlist_index),
+            "playlist_range": (playlist_index, playlist_index) if is_playlist and playlist_index else None,
+            "attempt": attempt + 1,
+            "catalog": catalog,
+        }
+        self.output(f"Повторная загрузка ({job['attempt']}/{MAX_VERIFY_ATTEMPTS}): {url}")
+        self._acquire()
+        try:
+            future = self.requeue(job)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+    def join(self):
+        """Ждёт завершения всех проверок и повторных загрузок."""
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+
+    def close(self):
+        self.join()
+        self.executor.shutdown(wait=True)
+        if self.verified_count or self.corrupt_count:
+            self.output(f"Проверено файлов: {self.verified_count}, не прошли проверку: {self.corrupt_count}")